@@ -1,8 +1,13 @@
 import streamlit as st
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 import seaborn as sns
 import pandas as pd
-import preprocessor, helper
+import io
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import preprocessor, helper, report, governor
 
 # Set dark background and layout
 st.set_page_config(
@@ -16,34 +21,213 @@ st.set_page_config(
 plt.style.use("dark_background")
 sns.set_theme(style="darkgrid", context='talk', font_scale=0.9)
 
+
+# The parsed chat is shared by every rerun and session that uploads the same file, so it is treated as read-only
+@st.cache_resource(show_spinner="Parsing chat...")
+def load_chat(digest, _raw):
+    try:
+        if _raw[:4] == b'PK\x03\x04':
+            # "Export with media" archive: only the chat text is decompressed
+            df = preprocessor.preprocess_zip(io.BytesIO(_raw))
+        else:
+            df = preprocessor.preprocess(_raw.decode("utf-8").splitlines())
+    except (ValueError, zipfile.BadZipFile):
+        # Archives without a chat text, corrupt archives and undecodable text all count as unrecognised
+        df = preprocessor.preprocess([])
+    # Message text is cleaned and tokenized here once; every text analysis reads these columns
+    df = helper.normalize_messages(df)
+    return (df, *index_chat(df))
+
+
+def index_chat(df):
+    # Measuring a frame is slow, so it is done once here and date ranges are sized from the average row
+    row_bytes = governor.footprint(df) / max(len(df), 1)
+    return helper.build_time_index(df), helper.build_token_index(df), row_bytes
+
+
+@st.cache_resource
+def background_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+
+@st.cache_data(show_spinner="Building analysis bundle...")
+def export_bundle(digest, _raw):
+    df, time_index, token_index, _ = load_chat(digest, _raw)
+    return report.save_bundle(df, time_index, token_index)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_bundle(digest, _raw):
+    bundle = report.open_bundle(_raw)
+    return bundle, report.bundle_chat(bundle)
+
+
+@st.cache_resource(show_spinner="Indexing saved chat...", max_entries=4)
+def index_saved_chat(digest, _raw):
+    # Only needed once a date window other than the saved one is picked
+    return index_chat(load_bundle(digest, _raw)[1])
+
+
+def upload_digest(uploaded_file):
+    # Cached loaders are keyed on the content of the upload, hashed once per uploaded file
+    digests = st.session_state.setdefault('upload_digests', {})
+    if uploaded_file.file_id not in digests:
+        digests[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return digests[uploaded_file.file_id]
+
+
+def session_store():
+    return st.session_state.setdefault('results_store', governor.new_store())
+
+
+def format_time_axis(ax):
+    # At most TIMELINE_MAX_LABELS dates on the axis, whatever the number of points
+    locator = mdates.AutoDateLocator(maxticks=helper.TIMELINE_MAX_LABELS)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+
+
+def exact_analysis(df):
+    _, threshold = helper.assign_sessions(df[df['user'] != 'group_notification'])
+    response_df = helper.get_response_times_df(df, threshold)
+    sentiment_df = helper.get_sentiment_scores(helper.preprocess_for_sentiment(df))
+    return response_df, sentiment_df
+
 ##  ______________________________________________________________________________________________________
 
 ## _________________________________________________________________________________________________________
 # Sidebar
 with st.sidebar:
     st.title("📊 WhatsApp Chat Analyzer")
-    uploaded_file = st.file_uploader("📁 Upload a WhatsApp TXT File", type=["txt"])
+    uploaded_file = st.file_uploader("📁 Upload a WhatsApp TXT/ZIP Export or Analysis Bundle",
+                                     type=["txt", "zip", report.BUNDLE_EXTENSION])
+
+    digest = upload_digest(uploaded_file) if uploaded_file else None
+    if uploaded_file and uploaded_file.name.endswith('.' + report.BUNDLE_EXTENSION):
+        # A saved analysis renders the whole chat straight from its stored results
+        try:
+            bundle, df = load_bundle(digest, uploaded_file.getvalue())
+        except (ValueError, KeyError, zipfile.BadZipFile) as error:
+            st.error(f"❌ Could not open the analysis bundle: {error}")
+            st.stop()
+    elif uploaded_file:
+        bundle = None
+        df, time_index, token_index, row_bytes = load_chat(digest, uploaded_file.getvalue())
 
     if uploaded_file:
-        data = uploaded_file.getvalue().decode("utf-8").splitlines()
-        df = preprocessor.preprocess(data)
-
         if not df.empty:
             users = ['Overall'] + sorted([
                 u for u in df['user'].unique()
                 if u != 'group_notification'
             ])
             selected_user = st.selectbox("👤 Select User", users)
+
+            first_day, last_day = df['dates'].iloc[0].date(), df['dates'].iloc[-1].date()
+            chat_rows = len(df)
+            date_range = st.date_input("📅 Date Range", value=(first_day, last_day),
+                                       min_value=first_day, max_value=last_day)
+            # While the second date is still being picked only the start is set; a cleared input means the whole chat
+            if len(date_range) == 2:
+                start_day, end_day = date_range
+            elif len(date_range) == 1:
+                start_day, end_day = date_range[0], last_day
+            else:
+                start_day, end_day = first_day, last_day
+            df = helper.slice_by_date(df, start_day, end_day)
+
+            # Other windows of a saved analysis are analysed from its stored chat, like an upload
+            saved_view = bundle is not None and (start_day, end_day) == (first_day, last_day)
+            if saved_view:
+                st.caption("📂 Saved analysis of the whole chat")
+                approx_mode = False
+            else:
+                if bundle is not None:
+                    time_index, token_index, row_bytes = index_saved_chat(digest, uploaded_file.getvalue())
+                approx_mode = st.toggle(
+                    "⚡ Approximate mode", value=len(df) >= helper.APPROX_MIN_MESSAGES,
+                    help="Estimate sentiment and response times from a stratified sample of messages"
+                )
+
             analyze_btn = st.button("🔍 Analyze")
 
+            if bundle is None:
+                # A bundle holds exact results for the whole chat, so it is gated like the background exact job
+                if governor.plan_analysis(chat_rows * row_bytes, False)[0] != 'exact':
+                    st.caption("Analysis bundles are not available: an exact analysis of the whole chat would not fit "
+                               "in this session's memory limit.")
+                elif st.button("📦 Prepare Analysis Bundle"):
+                    st.session_state['bundle_file'] = (uploaded_file.file_id, export_bundle(digest, uploaded_file.getvalue()))
+                bundle_file = st.session_state.get('bundle_file')
+                if bundle_file and bundle_file[0] == uploaded_file.file_id:
+                    st.download_button("💾 Download Analysis Bundle", bundle_file[1],
+                                       file_name=f"{uploaded_file.name.rsplit('.', 1)[0]}.{report.BUNDLE_EXTENSION}")
+        else:
+            st.error("❌ Invalid or empty chat file: no supported WhatsApp export format was recognised.")
+
 # Main Section
 if uploaded_file and 'analyze_btn' in locals():
     if df.empty:
-        st.error("❌ Invalid or empty chat file.")
+        st.error("❌ No messages in the selected date range.")
+    elif selected_user != 'Overall' and not (df['user'] == selected_user).any():
+        st.info(f"ℹ️ {selected_user} has no messages in the selected date range.")
     else:
+        store = session_store()
+
+        # Analyses predicted to overrun the session memory limit are downsampled or refused
+        if not saved_view:
+            mode, predicted = governor.plan_analysis(len(df) * row_bytes, approx_mode)
+            if mode is None:
+                st.error(f"❌ Analysing {len(df):,} messages would need about {predicted / 2 ** 20:,.0f} MB, over this "
+                         f"session's {governor.SESSION_BUDGET_MB:,.0f} MB memory limit. Narrow the date range.")
+                st.stop()
+            if mode == 'approximate' and not approx_mode:
+                st.warning(f"⚠️ An exact analysis of {len(df):,} messages would need about {predicted / 2 ** 20:,.0f} MB, "
+                           f"over this session's memory limit, so approximate mode was used instead.")
+                approx_mode = True
+
+        # Exact results computed in the background replace the sampled estimates once ready
+        exact_results = None
+        if approx_mode:
+            exact_jobs = st.session_state.setdefault('exact_jobs', {})
+            job_key = (uploaded_file.file_id, start_day, end_day)
+            job = exact_jobs.get(job_key)
+            if job is not None and job.done():
+                # Finished jobs move into the store, where they can be spilled like any other result
+                governor.store_put(store, ('exact',) + job_key, job.result())
+                del exact_jobs[job_key]
+            exact_results = governor.store_get(store, ('exact',) + job_key)
+
+            if exact_results is None and job is None:
+                st.info(f"⚡ Approximate mode: sentiment and response times are estimated from a "
+                        f"sample of about {helper.APPROX_SAMPLE_SIZE:,} messages.")
+                if governor.plan_analysis(len(df) * row_bytes, False)[0] != 'exact':
+                    st.caption("Exact results are not available: they would not fit in this session's memory limit.")
+                elif st.button("🎯 Compute exact results in background"):
+                    exact_jobs[job_key] = background_executor().submit(exact_analysis, df)
+                    st.rerun()
+            elif exact_results is None:
+                st.info("⏳ Exact results are being computed in the background.")
+                st.button("🔄 Refresh")
+
+        if saved_view:
+            results = report.bundle_results(bundle, selected_user)
+        else:
+            # Chat-wide results are kept per date range, so switching member does not recompute them
+            shared_key = ('shared', uploaded_file.file_id, start_day, end_day, approx_mode, exact_results is not None)
+            shared = governor.store_get(store, shared_key)
+            if shared is None:
+                shared = report.chat_results(df, time_index, start_day, end_day, approx_mode, exact_results)
+                governor.store_put(store, shared_key, shared)
+            results = {**shared, **report.user_results(selected_user, df, time_index, token_index, shared, start_day, end_day)}
+
+        resident, spilled = governor.resident_bytes(store), governor.spilled_bytes(store)
+        st.sidebar.caption(f"🧠 Session results: {resident / 2 ** 20:,.1f} MB in memory of a "
+                           f"{governor.SESSION_BUDGET_MB:,.0f} MB limit"
+                           + (f", {spilled / 2 ** 20:,.1f} MB spilled to disk" if spilled else ""))
+
         st.markdown("## 📈 Chat Summary")
 
-        num_messages, words, media, links, first_msg, last_msg = helper.fetch_start(selected_user, df)
+        num_messages, words, media, links, first_msg, last_msg = results['summary']
         col1, col2, col3, col4 = st.columns(4)
 
         with col1:
@@ -61,15 +245,27 @@ if uploaded_file and 'analyze_btn' in locals():
         fcol, lcol = st.columns(2)
         fcol.markdown(f"*First Message:* {first_msg}")
         lcol.markdown(f"*Last Message:* {last_msg}")
-        st.caption("Note: Media messages may appear as '<Media omitted>'.")
+
+        media_df = results['media']
+        if not media_df.empty:
+            st.markdown("### 📎 Media Breakdown")
+            has_sizes = media_df['size_mb'].sum() > 0
+            st.dataframe(
+                media_df[['media_type', 'count'] + (['size_mb'] if has_sizes else [])]
+                .rename(columns={'media_type': 'Type', 'count': 'Count', 'size_mb': 'Size (MB)'})
+                .style.format({'Count': '{:,}', 'Size (MB)': '{:.1f}'})
+                .set_properties(**{'color': 'black', 'background-color': '#F5F5F5'}),
+                hide_index=True
+            )
 
         ##  ______________________________________________________________________________________________________
 
         ## _________________________________________________________________________________________________________
         st.write("")
         st.markdown("---")
-        st.markdown("### 📆 Monthly Activity")
-        timeline = helper.montly_timeline(selected_user, df)
+        timeline = results['timeline']
+        period_label = helper.TIMELINE_FREQUENCIES[results['timeline_freq']]
+        st.markdown(f"### 📆 {period_label} Activity")
 
         # Create plot with custom style
         plt.style.use('default')  # Use matplotlib's default style
@@ -77,26 +273,23 @@ if uploaded_file and 'analyze_btn' in locals():
         fig.patch.set_facecolor('#FFFFFF')  # White background for figure
         ax.set_facecolor('#F5F5F5')  # Light grey background for plot area
 
-        # Plot styling
-        ax.plot(timeline['month_year'], timeline['message'],
-                color='#2C8C99', linewidth=2.5, marker='o', markersize=8,
+        # Plot styling; markers and value labels only while the points stay readable
+        few_points = len(timeline) <= helper.TIMELINE_MAX_LABELS
+        ax.plot(timeline['period'], timeline['message'],
+                color='#2C8C99', linewidth=2.5, marker='o' if few_points else None, markersize=8,
                 markerfacecolor='#FF6B6B', markeredgewidth=1)
 
-        # Add data labels
-        for i, (month, count) in enumerate(zip(timeline['month_year'], timeline['message'])):
-            vertical_offset = 5 if i % 2 == 0 else -5
-            ax.text(month, count + vertical_offset, f'{count}',
-                    ha='center', va='bottom' if i % 2 == 0 else 'top',
-                    fontsize=9, color='#2C8C99')
+        if few_points:
+            for i, (period, count) in enumerate(zip(timeline['period'], timeline['message'])):
+                ax.annotate(f'{count}', xy=(period, count), xytext=(0, 8 if i % 2 == 0 else -8),
+                            textcoords='offset points', ha='center',
+                            va='bottom' if i % 2 == 0 else 'top', fontsize=9, color='#2C8C99')
 
         # Customize axes and labels
-        ax.set_xlabel("Month-Year", fontsize=12, labelpad=15, color='#333333')
+        ax.set_xlabel("Date", fontsize=12, labelpad=15, color='#333333')
         ax.set_ylabel("Messages", fontsize=12, labelpad=15, color='#333333')
         ax.tick_params(axis='both', which='major', labelsize=10, colors='#333333')
-
-        # Rotate and align x-axis labels
-        plt.xticks(rotation='vertical', ha='right', fontsize=10)
-        plt.yticks(fontsize=10)
+        format_time_axis(ax)
 
         # Add grid and remove borders
         ax.grid(True, linestyle='--', linewidth=0.5, alpha=0.7, color='#AAAAAA')
@@ -104,15 +297,17 @@ if uploaded_file and 'analyze_btn' in locals():
         ax.spines[['left', 'bottom']].set_color('#666666')
 
         # Add annotation for peak point
-        max_point = timeline[timeline['message'] == timeline['message'].max()]
-        ax.annotate(f'Peak: {max_point["message"].values[0]}',
-                    xy=(max_point['month_year'], max_point['message']),
-                    xytext=(max_point['month_year'], max_point['message'] + 20),
-                    arrowprops=dict(arrowstyle='->', color='#FF6B6B'),
-                    ha='center', color='#FF6B6B', fontsize=10)
+        if not timeline.empty:
+            peak = timeline.loc[timeline['message'].idxmax()]
+            ax.annotate(f"Peak: {int(peak['message'])}",
+                        xy=(peak['period'], peak['message']),
+                        xytext=(0, 20), textcoords='offset points',
+                        arrowprops=dict(arrowstyle='->', color='#FF6B6B'),
+                        ha='center', color='#FF6B6B', fontsize=10)
 
         plt.tight_layout()
         st.pyplot(fig)
+        plt.close(fig)
 
 ##  ______________________________________________________________________________________________________
 
@@ -124,7 +319,7 @@ if uploaded_file and 'analyze_btn' in locals():
 
         with col1:
             st.subheader("🔥 Weekly Heatmap")
-            heatmap = helper.activity_heatmap(selected_user, df)
+            heatmap = results['heatmap']
 
             # Fixed heatmap with float handling
             fig, ax = plt.subplots(figsize=(10, 4))
@@ -146,13 +341,14 @@ if uploaded_file and 'analyze_btn' in locals():
             plt.title("Activity Distribution by Day & Hour", pad=20, fontsize=12, color='#2C8C99')
             plt.tight_layout()
             st.pyplot(fig)
+            plt.close(fig)
 
         with col2:
             st.subheader("📅 Day/Month Activity")
             tab1, tab2 = st.tabs(["📆 Daily", "🗓 Monthly"])
 
             with tab1:
-                daily = helper.busyday_graph(selected_user, df)
+                daily = results['busy_days']
 
                 # Fixed daily plot
                 fig, ax = plt.subplots(figsize=(8, 4))
@@ -185,9 +381,10 @@ if uploaded_file and 'analyze_btn' in locals():
                 plt.title("Daily Message Distribution", pad=15, fontsize=11, color='#2C8C99')
                 plt.tight_layout()
                 st.pyplot(fig)
+                plt.close(fig)
 
             with tab2:
-                monthly = helper.monthbusy_graph(selected_user, df)
+                monthly = results['busy_months']
 
                 # Fixed monthly plot
                 fig, ax = plt.subplots(figsize=(8, 4))
@@ -220,6 +417,7 @@ if uploaded_file and 'analyze_btn' in locals():
                 plt.title("Monthly Message Distribution", pad=15, fontsize=11, color='#FF6B6B')
                 plt.tight_layout()
                 st.pyplot(fig)
+                plt.close(fig)
 
 ##  ______________________________________________________________________________________________________
 
@@ -230,7 +428,7 @@ if uploaded_file and 'analyze_btn' in locals():
         st.markdown("-")
         if selected_user == "Overall":
             st.markdown("### 👥 Top Contributors")
-            top_users, user_df = helper.most_busy_person(df)
+            top_users, user_df = results['top_users'], results['top_user_share']
 
             col1, col2 = st.columns([2, 1])
             with col1:
@@ -251,6 +449,7 @@ if uploaded_file and 'analyze_btn' in locals():
                 ax.spines[['top', 'right']].set_visible(False)
                 plt.tight_layout()
                 st.pyplot(fig)
+                plt.close(fig)
 
             with col2:
                 # Style dataframe without changing data
@@ -274,27 +473,31 @@ if uploaded_file and 'analyze_btn' in locals():
 
         with col1:
             st.subheader("☁ Word Cloud")
-            wc = helper.create_wordcloud(selected_user, df)
-            fig, ax = plt.subplots(figsize=(10, 6))
+            if not results['word_frequencies']:
+                st.info("No words to show in the selected range.")
+            else:
+                wc = helper.create_wordcloud(results['word_frequencies'])
+                fig, ax = plt.subplots(figsize=(10, 6))
 
-            # Enhanced word cloud styling
-            ax.imshow(wc.recolor(colormap='viridis', random_state=42))  # ✅ Fixed closing parenthesis
-            ax.axis("off")
-            ax.set_facecolor('#F5F5F5')
-            fig.patch.set_facecolor('#F5F5F5')
+                # Enhanced word cloud styling
+                ax.imshow(wc.recolor(colormap='viridis', random_state=42))  # ✅ Fixed closing parenthesis
+                ax.axis("off")
+                ax.set_facecolor('#F5F5F5')
+                fig.patch.set_facecolor('#F5F5F5')
 
-            plt.title(
-                "Word Frequency Cloud\n(Size = Frequency)",
-                fontsize=14,
-                color='#2C8C99',
-                pad=20,
-                fontweight='bold'
-            )
-            st.pyplot(fig)
+                plt.title(
+                    "Word Frequency Cloud\n(Size = Frequency)",
+                    fontsize=14,
+                    color='#2C8C99',
+                    pad=20,
+                    fontweight='bold'
+                )
+                st.pyplot(fig)
+                plt.close(fig)
 
         with col2:
             st.subheader("🔠 Lexical Analysis")
-            common = helper.most_common_words(selected_user, df)
+            common = results['common_words']
 
             fig, ax = plt.subplots(figsize=(10, 6))
 
@@ -319,6 +522,7 @@ if uploaded_file and 'analyze_btn' in locals():
             ax.grid(axis='x', linestyle='--', alpha=0.5)
             plt.tight_layout()
             st.pyplot(fig)
+            plt.close(fig)
 
  ##_______________________________________________________________________________
 
@@ -329,7 +533,7 @@ if uploaded_file and 'analyze_btn' in locals():
         st.write("")
         st.markdown("--")
         st.markdown("### 😄 Emoji Insights")
-        emoji_df = helper.emoji_analysis(selected_user, df)
+        emoji_df = results['emojis']
 
         if not emoji_df.empty:
             emoji_df.columns = ['Emoji', 'Count']
@@ -388,6 +592,7 @@ if uploaded_file and 'analyze_btn' in locals():
                 plt.title("Top 5 Emoji Distribution", color='#2C8C99', fontsize=12, pad=20)
                 plt.setp(autotexts, size=10, color='white', weight='bold')
                 st.pyplot(fig)
+                plt.close(fig)
         else:
             st.info("🎭 No emojis detected in this conversation")
 
@@ -400,13 +605,10 @@ if uploaded_file and 'analyze_btn' in locals():
         st.markdown("---")
         st.markdown("### ⏱ Response Time Analysis")
 
-        # Get response time data (original logic untouched)
-        response_df = helper.get_response_times_df(df)
-        group_avg, _ = helper.get_response_time_analysis(selected_user, response_df)
+        threshold = results['threshold']
+        group_avg = results['group_avg']
 
         if not group_avg.empty:
-            # Same threshold calculation
-            threshold = response_df['response_time_min'].quantile(0.90)
 
             # Top 5 Fastest Responders (original logic)
             top5 = group_avg.head(5)
@@ -457,23 +659,110 @@ if uploaded_file and 'analyze_btn' in locals():
                 plt.ylabel("Avg Response (mins)", fontsize=10)
                 plt.tight_layout()
                 st.pyplot(fig)
+                plt.close(fig)
 
             # Enhanced data table
             st.markdown("#### 📋 Response Time Statistics")
-            styled_df = group_avg.rename(columns={
+            stats_df = group_avg
+            if results['response_intervals'] is not None:
+                st.caption("≈ Estimated from a stratified sample, with 95% confidence intervals")
+                stats_df = results['response_intervals']
+            stats_df = stats_df.rename(columns={
                 'responder': 'Member',
-                'response_time_min': 'Avg Response (mins)'
-            }).style \
+                'response_time_min': 'Avg Response (mins)',
+                'p50': 'P50 (mins)',
+                'p90': 'P90 (mins)',
+                'p99': 'P99 (mins)',
+                'ci_low': 'CI Low (mins)',
+                'ci_high': 'CI High (mins)',
+                'samples': 'Samples'
+            })
+            styled_df = stats_df.style \
                 .bar(subset=['Avg Response (mins)'], color='#FF6B6B', vmin=0) \
-                .format({'Avg Response (mins)': '{:.1f}'}) \
+                .format('{:.1f}', subset=[c for c in stats_df.columns if c.endswith('(mins)')]) \
                 .highlight_min(subset=['Avg Response (mins)'], color='#2C8C99') \
                 .set_properties(**{'color':'black','background-color': '#F5F5F5'})
 
             st.dataframe(styled_df, height=300)
 
+            # Pairwise view: a row of the interaction matrices for one member, the whole matrix for the group
+            reply_matrix = results['reply_matrix']
+            sampled = results['response_intervals'] is not None
+            if selected_user != 'Overall' and selected_user in reply_matrix.index:
+                st.markdown(f"#### 🤝 How {selected_user} Replies to Each Member")
+                if sampled:
+                    st.caption("≈ Reply counts and percentiles cover the sampled messages only; mentions cover the whole chat")
+                pairs_df = pd.DataFrame({
+                    'Replies': reply_matrix.loc[selected_user],
+                    'P50 (mins)': results['p50_matrix'].loc[selected_user],
+                    'P90 (mins)': results['p90_matrix'].loc[selected_user],
+                    'P99 (mins)': results['p99_matrix'].loc[selected_user],
+                    'Mentions': results['mention_matrix'].loc[selected_user],
+                }).rename_axis('Member')
+                pairs_df = pairs_df[(pairs_df['Replies'] > 0) | (pairs_df['Mentions'] > 0)]
+                st.dataframe(
+                    pairs_df.sort_values('Replies', ascending=False).style
+                    .format('{:.1f}', subset=['P50 (mins)', 'P90 (mins)', 'P99 (mins)'], na_rep='-')
+                    .set_properties(**{'color': 'black', 'background-color': '#F5F5F5'}),
+                    height=300
+                )
+            elif selected_user == 'Overall' and len(reply_matrix) > 1:
+                st.markdown("#### 🕸 Who Talks to Whom")
+                if sampled:
+                    st.caption("≈ Replies counted over the sampled messages, not the whole chat")
+                fig, ax = plt.subplots(figsize=(10, 6))
+                sns.heatmap(
+                    reply_matrix,
+                    ax=ax,
+                    cmap="YlGn",
+                    annot=len(reply_matrix) <= 15,
+                    fmt="d",
+                    linewidths=0.5,
+                    linecolor='#444444',
+                    cbar_kws={'label': 'Sampled replies' if sampled else 'Replies'}
+                )
+                plt.xlabel('Replied to', fontsize=10, color='#333333')
+                plt.ylabel('Replying member', fontsize=10, color='#333333')
+                plt.xticks(rotation=45, ha='right', fontsize=8, color='#555555')
+                plt.yticks(rotation=0, fontsize=8, color='#555555')
+                plt.tight_layout()
+                st.pyplot(fig)
+                plt.close(fig)
+
         else:
             st.info("📭 Insufficient data for response time analysis")
 
+        # Conversation sessions
+        st.write("")
+        st.markdown("---")
+        st.markdown("### 💬 Conversations")
+        stats = results['session_stats']
+        starters = results['starters']
+
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            st.metric("🧵 Conversations", f"{len(stats):,}")
+            st.metric("📏 Median Length", f"{stats['length'].median() if len(stats) else 0:.0f} msgs")
+            st.metric("⏳ Median Duration", f"{stats['duration_min'].median() if len(stats) else 0:.0f} mins")
+            if selected_user != 'Overall':
+                st.metric("🚩 Started", f"{starters.get(selected_user, 0):,}")
+
+        with col2:
+            if not starters.empty:
+                st.subheader("🚩 Who Starts Conversations")
+                fig, ax = plt.subplots(figsize=(8, 4))
+                top_starters = starters.head(5)
+                ax.bar(top_starters.index, top_starters.values,
+                       color='#2C8C99', edgecolor='#1A5F69', linewidth=1.2)
+                plt.xticks(rotation=35, ha='right', fontsize=9)
+                plt.grid(axis='y', linestyle='--', alpha=0.4)
+                ax.set_facecolor('#F5F5F5')
+                ax.spines[['top', 'right']].set_visible(False)
+                plt.ylabel("Conversations Started", fontsize=10)
+                plt.tight_layout()
+                st.pyplot(fig)
+                plt.close(fig)
+
 
 
 
@@ -482,18 +771,32 @@ if uploaded_file and 'analyze_btn' in locals():
         st.markdown("### 😃 Sentiment Insights")
         st.caption("Sentiment score ranges from -1 (Negative) to +1 (Positive)")
 
-        # Get sentiment data (original logic)
-        sentiment_df = helper.preprocess_for_sentiment(df)
+        sentiment_df = results['sentiment_df']
 
         if not sentiment_df.empty:
-            sentiment_df = helper.get_sentiment_scores(sentiment_df)
             avg_score, counts, _ = helper.get_sentiment_metrics(sentiment_df)
+            if results['sentiment_estimate'] is not None:
+                avg_score, avg_low, avg_high = results['sentiment_estimate']
+                st.caption(f"≈ Average sentiment estimated at {avg_score:.2f} "
+                           f"(95% CI {avg_low:.2f} to {avg_high:.2f}) from {len(sentiment_df):,} sampled messages")
+                st.dataframe(
+                    results['label_shares'].rename(columns={'label': 'Sentiment', 'percentage': 'Share %',
+                                                            'ci_low': 'CI Low %', 'ci_high': 'CI High %'})
+                    .style.format('{:.1f}', subset=['Share %', 'CI Low %', 'CI High %'])
+                    .set_properties(**{'color': 'black', 'background-color': '#F5F5F5'}),
+                    hide_index=True
+                )
 
             # ================================
             # Individual User Analysis
             # ================================
             if selected_user != "Overall":
                 user_avg, user_counts, user_df = helper.get_individual_sentiment(sentiment_df, selected_user)
+
+            if selected_user != "Overall" and user_df is None:
+                st.info(f"ℹ️ {selected_user} has no text messages to score in the selected date range.")
+
+            elif selected_user != "Overall":
                 comparison = helper.compare_with_group(user_df, sentiment_df)
 
                 st.markdown(f"#### {selected_user}'s Sentiment Breakdown")
@@ -543,6 +846,7 @@ if uploaded_file and 'analyze_btn' in locals():
                 plt.xlabel("Sentiment Score", fontsize=10, color='#333333')
                 plt.xticks(fontsize=9)
                 st.pyplot(fig)
+                plt.close(fig)
 
             # ================================
             # Group Analysis
@@ -603,6 +907,7 @@ if uploaded_file and 'analyze_btn' in locals():
 
                 plt.tight_layout()
                 st.pyplot(fig)
+                plt.close(fig)
 
             # ================================
             # Common Deep Dive
@@ -613,27 +918,27 @@ if uploaded_file and 'analyze_btn' in locals():
                 tab1, tab2 = st.tabs(["📈 Trends", "💬 Examples"])
 
                 with tab1:
-                    # Enhanced trend plot
-                    sentiment_df['month'] = sentiment_df['dates'].dt.strftime('%b-%Y')
-                    monthly = sentiment_df.groupby('month')['sentiment'].mean().reset_index()
+                    # Enhanced trend plot, on the same periods as the activity timeline
+                    trend = results['sentiment_trend'].dropna()
+                    period_label = helper.TIMELINE_FREQUENCIES[results['timeline_freq']]
 
                     fig, ax = plt.subplots(figsize=(10, 4))
-                    sns.lineplot(
-                        data=monthly,
-                        x='month',
-                        y='sentiment',
+                    ax.plot(
+                        trend['period'],
+                        trend['sentiment'],
                         color='#2C8C99',
-                        marker='o',
+                        marker='o' if len(trend) <= helper.TIMELINE_MAX_LABELS else None,
                         markersize=8,
                         linewidth=2
                     )
-                    plt.xticks(rotation='vertical', ha='right', fontsize=9)
+                    format_time_axis(ax)
                     plt.yticks(fontsize=9)
                     plt.grid(axis='y', linestyle='--', alpha=0.3)
                     ax.set_facecolor('#F5F5F5')
                     ax.spines[['top', 'right']].set_visible(False)
-                    plt.title("Monthly Sentiment Trend", fontsize=12, color='#333333', pad=15)
+                    plt.title(f"{period_label} Sentiment Trend", fontsize=12, color='#333333', pad=15)
                     st.pyplot(fig)
+                    plt.close(fig)
 
                 with tab2:
                     cols = st.columns(2)
@@ -0,0 +1,154 @@
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# Memory one dashboard session may hold in derived results, and use at the peak of an analysis
+SESSION_BUDGET_MB = float(os.environ.get('WCA_SESSION_MEMORY_MB', 1024))
+
+# Analysis peak relative to the in-memory size of the analysed messages, measured on synthetic exports;
+# approximate mode still segments sessions over every message, so it saves less than the sample suggests
+EXACT_PEAK_FACTOR = 1.0
+APPROX_PEAK_FACTOR = 0.8
+
+
+def footprint(value, deep=True):
+    """Estimated bytes held by a result; containers are measured member by member.
+    Without deep, text columns count only their pointers, for results whose strings belong to the cached chat"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=deep).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=deep))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if sparse.issparse(value):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, dict):
+        return sum(footprint(member, deep) for member in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(footprint(member, deep) for member in value)
+    return sys.getsizeof(value)
+
+
+def plan_analysis(size, approximate, budget_mb=SESSION_BUDGET_MB):
+    """The mode an analysis of messages taking size bytes can run in within the budget ('exact', 'approximate' or None),
+    and its predicted peak bytes"""
+    budget = budget_mb * 2 ** 20
+    if not approximate and size * EXACT_PEAK_FACTOR <= budget:
+        return 'exact', size * EXACT_PEAK_FACTOR
+    if size * APPROX_PEAK_FACTOR <= budget:
+        return 'approximate', size * APPROX_PEAK_FACTOR
+    return None, size * APPROX_PEAK_FACTOR
+
+
+## result store
+
+
+def new_store(budget_mb=SESSION_BUDGET_MB):
+    """Least-recently-used results of one session; frames of cold entries are spilled to parquet over budget"""
+    return {'budget': int(budget_mb * 2 ** 20), 'entries': OrderedDict(), 'spill_dir': None}
+
+
+def resident_bytes(store):
+    return sum(entry['bytes'] for entry in store['entries'].values())
+
+
+def spilled_bytes(store):
+    return sum(entry['disk'] for entry in store['entries'].values())
+
+
+def store_put(store, key, value):
+    # Results computed from the chat point at its strings rather than copying them, so they are measured shallow
+    store_drop(store, key)
+    store['entries'][key] = {'value': value, 'bytes': footprint(value, deep=False), 'disk': 0, 'files': [],
+                             'owns_text': False}
+    _enforce(store, key)
+
+
+def store_get(store, key):
+    """The stored value, read back from disk if it was spilled; None if absent"""
+    entry = store['entries'].get(key)
+    if entry is None:
+        return None
+    store['entries'].move_to_end(key)
+    if entry['files']:
+        # Frames read back from disk hold their own strings
+        entry['value'] = _restore(entry['value'])
+        _remove_files(entry)
+        entry['owns_text'] = True
+        entry['bytes'], entry['disk'] = footprint(entry['value']), 0
+        _enforce(store, key)
+    return entry['value']
+
+
+def store_drop(store, key):
+    entry = store['entries'].pop(key, None)
+    if entry is not None:
+        _remove_files(entry)
+
+
+def _enforce(store, keep):
+    # Spill from the least recently used end until the resident results fit again
+    for key, entry in list(store['entries'].items()):
+        if resident_bytes(store) <= store['budget']:
+            break
+        if key != keep and not entry['files']:
+            _spill(store, entry)
+
+
+def _spill(store, entry):
+    if store['spill_dir'] is None:
+        # Removed with the store when the session goes away
+        store['spill_dir'] = tempfile.TemporaryDirectory(prefix='wca-spill-')
+    before = entry['bytes']
+    entry['value'] = _spill_value(entry['value'], store['spill_dir'].name, entry['files'])
+    entry['bytes'] = footprint(entry['value'], entry['owns_text'])
+    entry['disk'] = before - entry['bytes']
+
+
+def _spill_value(value, directory, files):
+    # Frames and series go to parquet; anything else stays in memory
+    if isinstance(value, dict):
+        return {key: _spill_value(member, directory, files) for key, member in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_spill_value(member, directory, files) for member in value)
+    if not isinstance(value, (pd.DataFrame, pd.Series)):
+        return value
+
+    frame = value.to_frame(name='value') if isinstance(value, pd.Series) else value
+    handle, path = tempfile.mkstemp(suffix='.parquet', dir=directory)
+    os.close(handle)
+    try:
+        frame.set_axis([str(c) for c in frame.columns], axis=1).to_parquet(path)
+    except (TypeError, ValueError):
+        os.remove(path)
+        return value
+    files.append(path)
+    if isinstance(value, pd.Series):
+        return {'spilled': path, 'series': value.name}
+    return {'spilled': path, 'columns': list(value.columns), 'columns_name': value.columns.name}
+
+
+def _restore(value):
+    if isinstance(value, dict) and 'spilled' in value:
+        frame = pd.read_parquet(value['spilled'])
+        if 'series' in value:
+            return frame.iloc[:, 0].rename(value['series'])
+        frame.columns = pd.Index(value['columns'], name=value['columns_name'])
+        return frame
+    if isinstance(value, dict):
+        return {key: _restore(member) for key, member in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_restore(member) for member in value)
+    return value
+
+
+def _remove_files(entry):
+    for path in entry['files']:
+        if os.path.exists(path):
+            os.remove(path)
+    entry['files'] = []
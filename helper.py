@@ -1,10 +1,9 @@
 from wordcloud import WordCloud
-from urlextract import URLExtract
-extract = URLExtract()
 import pandas as pd
+import numpy as np
 import emoji
-from collections import Counter
 import seaborn as sns
+from scipy import sparse
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import re
 
@@ -12,117 +11,301 @@ import re
 analyzer = SentimentIntensityAnalyzer()
 
 
-def fetch_start(selected_user, df):
+# Web links: anything with a scheme or "www.", plus bare domains on common top-level domains
+LINK_PATTERN = (r'(?:https?://|www\.)[^\s<>"]+'
+                r'|(?<![@\w.-])[\w-]+(?:\.[\w-]+)*\.(?:com|org|net|in|io|co|edu|gov|me|ly|gl|be|app|dev)\b(?:/[^\s<>"]*)?')
 
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+
+def message_counters(df):
+    """Messages, words, media and links contributed by every row, counted in one vectorized pass"""
+    return pd.DataFrame({
+        'messages': np.ones(len(df), dtype=np.int64),
+        'words': df['message'].str.count(r'\S+').to_numpy(dtype=np.int64),
+        'media': df['media_type'].notna().to_numpy(dtype=np.int64),
+        'links': df['links'].to_numpy(dtype=np.int64),
+    }, index=df.index)
 
 
-    num_message = df.shape[0]
-    words = []
-    for message in df['message']:
-        words.extend(message.split())
+def fetch_start(selected_user, df, time_index, start, end):
+    """Summary counts from the time index, plus the first and last message of the (already sliced) chat"""
+    summary = range_summary(time_index, start, end)
+    if selected_user == 'Overall':
+        totals = summary.sum()
+        mask = (df['user'] != 'group_notification').to_numpy()
+    else:
+        totals = summary.loc[selected_user]
+        mask = (df['user'] == selected_user).to_numpy()
 
-    num_media_message = df[df['message'] == '<Media omitted>'].shape[0]
+    first_message, last_message = '', ''
+    if mask.any():
+        rows = df.iloc[[mask.argmax(), len(mask) - 1 - mask[::-1].argmax()]]
+        first_message, last_message = (f"{row['user']}: {row['message']}: {row['dates']}"
+                                        for _, row in rows.iterrows())
 
-    links = []
-    for messages in df['message']:
-        links.extend(extract.find_urls(messages))
+    return (int(totals['messages']), int(totals['words']), int(totals['media']), int(totals['links']),
+            first_message, last_message)
 
-    real_df = df[df['user'] != 'group_notification']
 
-    first_row = real_df.iloc[0]
-    last_row = real_df.iloc[-1]
+def media_stats(selected_user, df):
+    """Media messages per kind, with their size when the export archive included the files"""
+    if selected_user != 'Overall':
+        df = df[df['user'] == selected_user]
 
-    first_message = f"{first_row['user']}: {first_row['message']}: {first_row['dates']}"
-    last_message = f"{last_row['user']}: {last_row['message']}: {last_row['dates']}"
+    media = df[df['media_type'].notna()]
+    sizes = media['media_size'] if 'media_size' in media else pd.Series(np.nan, index=media.index)
+    stats = pd.DataFrame({'media_type': media['media_type'], 'size_mb': sizes / 2 ** 20})
+    stats = stats.groupby('media_type').agg(count=('media_type', 'size'), size_mb=('size_mb', 'sum'))
+    return stats.sort_values('count', ascending=False).reset_index()
 
-    return num_message, len(words), num_media_message, len(links), first_message, last_message
 
+def most_busy_person(df, user_counts=None):
+    if user_counts is None:
+        user_counts = df['user'].value_counts()
 
-def most_busy_person(df):
-    x = df['user'].value_counts().head()
-    df = round(df['user'].value_counts() / df['user'].shape[0] * 100).reset_index().rename(
+    x = user_counts.head()
+    df = round(user_counts / user_counts.sum() * 100).reset_index().rename(
         columns={'user': 'members', 'count': 'percentage'})
 
     return x, df
 
-def create_wordcloud(selected_user, df):
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
 
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+## time range
 
-    temp = df[df['user'] != 'group_notification']
-    temp['message'] = temp['message'].astype(str)
-    temp = temp[temp['message'] != '<Media omitted>']
-    temp = temp[temp['message'].str.contains(r'[a-zA-Z]', na=False)]
 
-    def remove_stop_words(message):
-        y = []
-        for words in message.lower().split():
-            if words not in stop_words:
-                y.append(words)
-        return " ".join(y)
+def build_time_index(df):
+    """Per-day message, word, media and link counts for every user, stored as prefix sums"""
+    day_codes, days = pd.factorize(df['dates'].dt.normalize(), sort=True)
+    user_codes, users = pd.factorize(df['user'])
+    cells = day_codes * len(users) + user_codes
 
-    wc = WordCloud(width=500, height=500, min_font_size=10,background_color='white')
-    temp['message'] = temp['message'].apply(remove_stop_words)
-    df_wc = wc.generate(temp['message'].str.cat(sep=" "))
-    return df_wc
+    index = {'days': days.values, 'users': np.asarray(users)}
+    for name, values in message_counters(df).items():
+        counts = np.bincount(cells, weights=values, minlength=len(days) * len(users))
+        counts = counts.astype(np.int64).reshape(len(days), len(users))
 
-def most_common_words(selected_user, df):
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
+        # Row i holds the totals of all days before days[i]; the extra leading row is zero
+        prefix = np.zeros((len(days) + 1, len(users)), dtype=np.int64)
+        np.cumsum(counts, axis=0, out=prefix[1:])
+        index[name] = prefix
+    return index
 
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
 
-    temp = df[df['user'] != 'group_notification']
-    # temp['message'] = temp['message'].astype(str)
-    temp = temp[temp['message'] != '<Media omitted>']
-    # temp = temp[temp['message'].str.contains(r'[a-zA-Z]', na=False)]
+def _date_bounds(dates, start, end):
+    # dates must be sorted; start and end are inclusive calendar days
+    lo = np.searchsorted(dates, np.datetime64(start, 'D'), side='left')
+    hi = np.searchsorted(dates, np.datetime64(end, 'D') + np.timedelta64(1, 'D'), side='left')
+    return lo, hi
 
-    words = []
 
-    for messages in temp['message']:
-        for word in messages.lower().split():
-            if word not in stop_words:
-                words.append(word)
-    most_common_df = pd.DataFrame(Counter(words).most_common(20))
-    return most_common_df
+def slice_by_date(df, start, end):
+    """Messages between two dates (inclusive), via binary search on the sorted dates"""
+    lo, hi = _date_bounds(df['dates'].values, start, end)
+    return df.iloc[lo:hi]
 
 
+def range_user_counts(time_index, start, end):
+    """Messages per user between two dates (inclusive), answered from the prefix sums"""
+    lo, hi = _date_bounds(time_index['days'], start, end)
+    totals = time_index['messages'][hi] - time_index['messages'][lo]
+
+    user_counts = pd.Series(totals, index=pd.Index(time_index['users'], name='user'), name='count')
+    return user_counts[user_counts > 0].sort_values(ascending=False, kind='stable')
+
+
+def range_summary(time_index, start, end):
+    """Messages, words, media and links per user between two dates (inclusive)"""
+    lo, hi = _date_bounds(time_index['days'], start, end)
+    return pd.DataFrame({name: time_index[name][hi] - time_index[name][lo]
+                         for name in ['messages', 'words', 'media', 'links']},
+                        index=pd.Index(time_index['users'], name='user'))
+
+## text normalization
+
+
+# Mentions are "@name", or "@<name>" wrapped in Unicode isolates when the name has spaces; the name is captured
+MENTION_PATTERN = r'(?<!\w)@(?:\u2068([^\u2069]*)\u2069|(\w+))'
+
+# Direction marks and isolates WhatsApp puts around names and numbers
+FORMAT_CHARS = r'[\u200e\u200f\u2066-\u2069]'
+
+# Stripped from both ends of a token, so "morning," and "morning" agree
+TOKEN_PUNCTUATION = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~“”‘’…–—¡¿'
+
+
+def _char_ranges(chars):
+    # A regex class body of contiguous code point ranges; astral characters cannot use a charset bitmap
+    points = sorted({ord(c) for c in chars})
+    breaks = np.flatnonzero(np.diff(points) != 1) + 1
+    return ''.join(f'{re.escape(chr(run[0]))}-{re.escape(chr(run[-1]))}'
+                   for run in np.split(np.array(points), breaks))
+
+
+# Runs of characters that occur in emoji; each distinct run is split into emoji once per chat.
+# Digits, "#" and "*" only count when they start a keycap sequence
+EMOJI_RUN = re.compile(r'(?:[#*0-9](?=[\ufe0f\u20e3])|['
+                       + _char_ranges(c for e in emoji.EMOJI_DATA for c in e if ord(c) > 127) + '])+')
+
+# Romanized Hindi has no standard spelling: canonical form first, then the variants mapped onto it
+HINGLISH_VARIANTS = {}
+for variants in [
+    'nahi nahin nhi nai nahii nhin',
+    'kya kyaa kia',
+    'kyun kyu kyon kiyu kiu',
+    'accha acha achha acchha achchha',
+    'theek thik thk tik thek',
+    'bahut bohot bahot bhot boht bohat',
+    'haan han haa',
+    'yaar yar yaara',
+    'pata pta',
+    'kuch kuchh kch',
+    'matlab mtlb',
+    'abhi abi',
+    'pyaar pyar',
+    'khana khaana',
+    'ok okay okk okie k',
+]:
+    canonical, *spellings = variants.split()
+    HINGLISH_VARIANTS.update({spelling: canonical for spelling in spellings})
+
+
+def load_stop_words():
+    with open('stop_hinglish.txt', 'r') as f:
+        return set(f.read().split())
+
+
+def _join_by_row(parts):
+    # Space-join the pieces of each row of an exploded series; equal index values are adjacent
+    if parts.empty:
+        return pd.Series(dtype=object)
+    rows = parts.index.to_numpy()
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    joined = np.add.reduceat((parts + ' ').to_numpy(dtype=object), starts)
+    return pd.Series(joined, index=rows[starts], dtype=object).str[:-1]
+
+
+def normalize_messages(df):
+    """Adds links (count), clean_msg (links, mentions and direction marks removed), mentions, emojis and
+    tokens (lowercase, edge punctuation stripped, Hinglish spellings unified, no stop words)"""
+    df = df.copy()
+    messages = df['message'].astype(str)
+    df['links'] = messages.str.count(LINK_PATTERN)
+    df['clean_msg'] = messages.str.replace(LINK_PATTERN, '', regex=True) \
+        .str.replace(MENTION_PATTERN, '', regex=True).str.replace(FORMAT_CHARS, '', regex=True).str.strip()
+
+    # Mentioned names, lowercased with spaces removed so "@<Alice Smith>" and "@alicesmith" agree
+    found = messages.str.extractall(MENTION_PATTERN)
+    names = found[0].fillna(found[1]).str.replace(r'\s+', '', regex=True).str.lower()
+    names = names[names != ''].droplevel('match')
+    df['mentions'] = _join_by_row(names).reindex(df.index, fill_value='')
+
+    # Only messages with non-ASCII characters can hold emoji
+    emojis = pd.Series('', index=df.index, dtype=object)
+    text = df['clean_msg'].copy()
+    has_emoji = text.str.contains(r'[^\x00-\x7f]')
+    runs = text[has_emoji].str.findall(EMOJI_RUN).explode().dropna()
+    split = {run: ' '.join(found['emoji'] for found in emoji.emoji_list(run)) for run in runs.unique()}
+    runs = runs.map(split)
+    joined = _join_by_row(runs[runs != ''])
+    emojis[joined.index] = joined.to_numpy()
+    text[has_emoji] = text[has_emoji].str.replace(EMOJI_RUN, ' ', regex=True)
+    df['emojis'] = emojis
+
+    # Lowercased only now: some emoji, like Ⓜ, have a lowercase form that is not an emoji
+    text = text.str.lower()
+
+    # "sooooo" and "soo" are the same word; three or more repeats collapse to two letters so "good" stays "good"
+    words = text.str.replace(r'([^\W\d_])\1{2,}', r'\1\1', regex=True).str.split().explode().dropna()
+    words = words.str.strip(TOKEN_PUNCTUATION)
+    words = words[words != '']
+    words = words.map(HINGLISH_VARIANTS).fillna(words)
+    words = words[~words.isin(load_stop_words())]
+    df['tokens'] = _join_by_row(words).reindex(df.index, fill_value='')
+    return df
+
 
-def emoji_analysis(selected_user, df):
+## word usage
+
+
+def build_token_index(df):
+    """Vocabulary plus a sparse (user, day) x token count matrix, built once per chat"""
+    temp = df[(df['user'] != 'group_notification') & df['media_type'].isna()]
+
+    # One matrix row per (user, day) pair, ordered by day so date ranges are contiguous
+    user_codes, users = pd.factorize(temp['user'])
+    day_codes, days = pd.factorize(temp['dates'].dt.normalize(), sort=True)
+    row_codes, row_keys = pd.factorize(day_codes * len(users) + user_codes, sort=True)
+
+    words = temp['tokens'].str.split().explode().dropna()
+    token_codes, vocab = pd.factorize(words)
+    token_rows = pd.Series(row_codes, index=temp.index).loc[words.index].to_numpy()
+
+    counts = sparse.coo_matrix(
+        (np.ones(len(token_codes), dtype=np.int64), (token_rows, token_codes)),
+        shape=(len(row_keys), len(vocab))
+    ).tocsr()
+
+    vocab = np.asarray(vocab, dtype=object)
+    return {
+        'vocab': vocab,
+        'has_letters': pd.Series(vocab, dtype=object).str.contains(r'[a-zA-Z]').to_numpy(dtype=bool),
+        'users': np.asarray(users),
+        'row_user': row_keys % len(users),
+        'row_day': days.values[row_keys // len(users)],
+        'counts': counts,
+    }
+
+
+def _token_totals(token_index, selected_user, start=None, end=None):
+    # Sum the matrix rows that fall in the date range and belong to the user
+    lo, hi = 0, token_index['counts'].shape[0]
+    if start is not None and end is not None:
+        lo, hi = _date_bounds(token_index['row_day'], start, end)
+
+    counts = token_index['counts'][lo:hi]
     if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    emoji_list = []
-    for message in df['message']:
-        # Use emoji.distinct_emoji_list() for better handling
-        emojis_in_msg = emoji.emoji_list(message)
-        emoji_list.extend([e['emoji'] for e in emojis_in_msg])
-
-    emoji_counter = Counter(emoji_list)
-    emoji_df = pd.DataFrame(
-        emoji_counter.most_common(),
-        columns=['Emoji', 'Count']
-    )
+        user_code = np.flatnonzero(token_index['users'] == selected_user)
+        counts = counts[token_index['row_user'][lo:hi] == (user_code[0] if len(user_code) else -1)]
+
+    return np.asarray(counts.sum(axis=0)).ravel()
+
+
+def _top_k(totals, k):
+    k = min(k, np.count_nonzero(totals))
+    if k == 0:
+        return np.array([], dtype=np.int64)
+    top = np.argpartition(-totals, k - 1)[:k]
+    return top[np.argsort(-totals[top], kind='stable')]
+
 
-    # Ensure numeric type
-    emoji_df['Count'] = pd.to_numeric(emoji_df['Count'])
+def word_frequencies(selected_user, token_index, start=None, end=None):
+    totals = _token_totals(token_index, selected_user, start, end)
+    totals[~token_index['has_letters']] = 0
 
-    return emoji_df
+    top = _top_k(totals, 200)
+    return dict(zip(token_index['vocab'][top], totals[top].tolist()))
 
-def montly_timeline(selected_user, df):
+def create_wordcloud(frequencies):
+    wc = WordCloud(width=500, height=500, min_font_size=10,background_color='white')
+    df_wc = wc.generate_from_frequencies(frequencies)
+    return df_wc
+
+def most_common_words(selected_user, token_index, start=None, end=None):
+    totals = _token_totals(token_index, selected_user, start, end)
+    top = _top_k(totals, 20)
+
+    most_common_df = pd.DataFrame({0: token_index['vocab'][top], 1: totals[top]})
+    return most_common_df
+
+
+
+def emoji_analysis(selected_user, df):
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
 
-    timeline = df.groupby(['year', 'month', 'month_num']).count()['message'].reset_index()
-    timeline = timeline.sort_values(by=['year', 'month_num']).reset_index(drop=True)
-    timeline['month_year'] = timeline['month'] + "-" + timeline['year'].astype(str)
-
-    return timeline
+    # Most used first; ties keep the order of first use
+    counts = df['emojis'].str.split().explode().dropna().value_counts(sort=False)
+    counts = counts.sort_values(ascending=False, kind='stable')
+    return pd.DataFrame({'Emoji': counts.index.to_numpy(dtype=object), 'Count': counts.to_numpy(dtype=np.int64)})
 
 def busyday_graph(selected_user, df):
     if selected_user != 'Overall':
@@ -148,71 +331,312 @@ def activity_heatmap(selected_user, df):
 
     return user_heatmaps
 
-def get_response_times_df(df):
-    # Preprocessing for response analysis
-    filtered_df = df[
-        (df['user'] != 'group_notification') &
-        (~df['message'].str.contains('@', na=False)) &
-        (~df['message'].str.contains('<Media omitted>', na=False))
-        ].sort_values('dates').reset_index(drop=True)
+## timeline
+
+
+# Resample rules from finest to coarsest, with the label shown on the charts
+TIMELINE_FREQUENCIES = {'D': 'Daily', 'W-MON': 'Weekly', 'MS': 'Monthly', 'QS': 'Quarterly', 'YS': 'Yearly'}
+TIMELINE_BIN_DAYS = {'D': 1, 'W-MON': 7, 'MS': 30.44, 'QS': 91.31, 'YS': 365.25}
+TIMELINE_MAX_POINTS = 60
+TIMELINE_MAX_LABELS = 12
+
+
+def timeline_frequency(start, end):
+    """The finest resample rule that keeps a date span within TIMELINE_MAX_POINTS points"""
+    span = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    for rule, days in TIMELINE_BIN_DAYS.items():
+        if span / days <= TIMELINE_MAX_POINTS:
+            return rule
+    return 'YS'
+
+
+def _resample(dates, values, rule, how):
+    # Bins are labelled by their first day: the Monday of a week, the 1st of a month or quarter
+    series = pd.Series(values, index=pd.DatetimeIndex(dates))
+    return getattr(series.resample(rule, label='left', closed='left'), how)()
+
 
-    # Calculate dynamic threshold
-    filtered_df['time_gap'] = filtered_df['dates'].diff().dt.total_seconds().div(60).fillna(0)
-    threshold = filtered_df['time_gap'].quantile(0.90)
+def activity_timeline(selected_user, df, rule):
+    """Messages per period, with empty periods kept as zero"""
+    if selected_user != 'Overall':
+        df = df[df['user'] == selected_user]
+
+    counts = _resample(df['dates'], np.ones(len(df), dtype=np.int64), rule, 'sum')
+    return pd.DataFrame({'period': counts.index, 'message': counts.to_numpy()})
+
+
+def sentiment_timeline(sentiment_df, rule):
+    """Mean sentiment per period, NaN where no message was scored"""
+    means = _resample(sentiment_df['dates'], sentiment_df['sentiment'].to_numpy(), rule, 'mean')
+    return pd.DataFrame({'period': means.index, 'sentiment': means.to_numpy()})
 
-    # Calculate response times
-    response_data = []
-    for i in range(len(filtered_df)):
-        sender = filtered_df.loc[i, 'user']
-        sender_time = filtered_df.loc[i, 'dates']
-        responders = set()
 
-        for j in range(i + 1, len(filtered_df)):
-            responder = filtered_df.loc[j, 'user']
-            responder_time = filtered_df.loc[j, 'dates']
+## conversation sessions
 
-            if (responder_time - sender_time).total_seconds() / 60 > threshold:
-                break
 
-            if responder != sender and responder not in responders:
-                time_diff = (responder_time - sender_time).total_seconds() / 60
-                response_data.append({
-                    'sender': sender,
-                    'responder': responder,
-                    'response_time_min': round(time_diff, 2)
-                })
-                responders.add(responder)
+def assign_sessions(df, gap=None, quantile=0.90):
+    """Tag every message with a session id; a new session starts after a gap longer than `gap` minutes"""
+    session_df = df.sort_values('dates', kind='stable').reset_index(drop=True)
+    session_df['time_gap'] = session_df['dates'].diff().dt.total_seconds().div(60).fillna(0)
+
+    # Dynamic threshold unless the caller fixed one
+    if gap is None:
+        gap = session_df['time_gap'].quantile(quantile) if len(session_df) else 0.0
+
+    session_df['session_id'] = (session_df['time_gap'] > gap).cumsum()
+    return session_df, gap
+
+
+def session_stats(session_df):
+    """Length, participants, initiator and duration of every session"""
+    stats = session_df.groupby('session_id').agg(
+        start=('dates', 'first'),
+        end=('dates', 'last'),
+        length=('user', 'size'),
+        participants=('user', 'nunique'),
+        initiator=('user', 'first'),
+    )
+    stats['duration_min'] = (stats['end'] - stats['start']).dt.total_seconds().div(60)
+    return stats
 
-    return pd.DataFrame(response_data)
 
+def conversation_starters(stats):
+    """How often each member opened a session that someone else joined"""
+    return stats.loc[stats['participants'] > 1, 'initiator'].value_counts()
 
-def get_response_time_analysis(selected_user, response_df):
-    # Group-level analysis
-    group_avg = response_df.groupby('responder')['response_time_min'].mean().sort_values().reset_index()
+
+def _response_candidates(df, gap=None):
+    # Preprocessing for response analysis
+    filtered_df = df[
+        (df['user'] != 'group_notification') &
+        (df['mentions'] == '') &
+        df['media_type'].isna()
+        ]
+    return assign_sessions(filtered_df, gap)
+
+
+def _response_pairs(filtered_df, threshold, sender_positions=None):
+    # For every sender message, the first later message of each other member is that member's
+    # response, as long as it arrives within the session threshold
+    user_codes, users = pd.factorize(filtered_df['user'])
+    minutes = filtered_df['dates'].values.astype('datetime64[s]').astype(np.int64) / 60
+    if sender_positions is None:
+        sender_positions = np.arange(len(filtered_df))
+
+    senders, responders = [], []
+    for code in range(len(users)):
+        own = np.flatnonzero(user_codes == code)
+        nxt = np.searchsorted(own, sender_positions, side='right')
+        answered = (nxt < len(own)) & (user_codes[sender_positions] != code)
+        senders.append(sender_positions[answered])
+        responders.append(own[nxt[answered]])
+
+    sender_pos = np.concatenate(senders) if senders else np.array([], dtype=np.int64)
+    responder_pos = np.concatenate(responders) if responders else np.array([], dtype=np.int64)
+    time_diff = minutes[responder_pos] - minutes[sender_pos]
+
+    keep = time_diff <= threshold
+    order = np.lexsort((responder_pos[keep], sender_pos[keep]))
+    sender_pos, responder_pos, time_diff = sender_pos[keep][order], responder_pos[keep][order], time_diff[keep][order]
+
+    return pd.DataFrame({
+        'sender': users[user_codes[sender_pos]],
+        'responder': users[user_codes[responder_pos]],
+        'response_time_min': np.round(time_diff, 2),
+    })
+
+
+def get_response_times_df(df, gap=None):
+    filtered_df, threshold = _response_candidates(df, gap)
+    return _response_pairs(filtered_df, threshold)
+
+
+## response time quantiles
+
+
+# Items kept per sketch level; groups smaller than this keep exact quantiles
+SKETCH_K = 200
+
+
+def new_sketch(k=SKETCH_K):
+    """Empty mergeable quantile sketch: KLL-style levels where an item on level h stands for 2**h values"""
+    return {'k': k, 'levels': [np.empty(0)], 'count': 0, 'total': 0.0, 'flip': 0}
+
+
+def _compress(sketch):
+    levels = sketch['levels']
+    level = 0
+    while level < len(levels):
+        # Lower levels get geometrically smaller capacities
+        capacity = max(2, int(np.ceil(sketch['k'] * (2 / 3) ** (len(levels) - 1 - level))))
+        if len(levels[level]) > capacity:
+            items = np.sort(levels[level])
+            leftover, items = items[len(items) - len(items) % 2:], items[:len(items) - len(items) % 2]
+
+            # Keep every other item, alternating the offset so the errors cancel out
+            sketch['flip'] ^= 1
+            if level + 1 == len(levels):
+                levels.append(np.empty(0))
+            levels[level + 1] = np.concatenate((levels[level + 1], items[sketch['flip']::2]))
+            levels[level] = leftover
+        level += 1
+    return sketch
+
+
+def sketch_update(sketch, values):
+    """Add new values to a sketch in place"""
+    values = np.asarray(values, dtype=float)
+    sketch['levels'][0] = np.concatenate((sketch['levels'][0], values))
+    sketch['count'] += len(values)
+    sketch['total'] += float(values.sum())
+    return _compress(sketch)
+
+
+def sketch_merge(a, b):
+    """Combine two sketches, e.g. from different chat shards or worker processes"""
+    height = max(len(a['levels']), len(b['levels']))
+    empty = np.empty(0)
+    merged = {
+        'k': min(a['k'], b['k']),
+        'levels': [np.concatenate((a['levels'][h] if h < len(a['levels']) else empty,
+                                   b['levels'][h] if h < len(b['levels']) else empty))
+                   for h in range(height)],
+        'count': a['count'] + b['count'],
+        'total': a['total'] + b['total'],
+        'flip': a['flip'],
+    }
+    return _compress(merged)
+
+
+def sketch_quantile(sketch, q):
+    if sketch['count'] == 0:
+        return np.nan
+    # Nothing was compacted yet, so the quantile is exact
+    if len(sketch['levels']) == 1:
+        return float(np.quantile(sketch['levels'][0], q))
+
+    items = np.concatenate(sketch['levels'])
+    weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(sketch['levels'])])
+    order = np.argsort(items, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    rank = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+    return float(items[order][min(rank, len(items) - 1)])
+
+
+def response_sketches(response_df, sketches=None):
+    """Quantile sketch of response times for every (responder, sender) pair, updated in place if given"""
+    sketches = {} if sketches is None else sketches
+    for pair, times in response_df.groupby(['responder', 'sender'])['response_time_min']:
+        sketch_update(sketches.setdefault(pair, new_sketch()), times.to_numpy())
+    return sketches
+
+
+def merge_response_sketches(a, b):
+    merged = dict(a)
+    for pair, sketch in b.items():
+        merged[pair] = sketch_merge(merged[pair], sketch) if pair in merged else sketch
+    return merged
+
+
+def _sketch_table(sketches, key):
+    rows = [{
+        key: name,
+        'response_time_min': sketch['total'] / sketch['count'],
+        'p50': sketch_quantile(sketch, 0.5),
+        'p90': sketch_quantile(sketch, 0.9),
+        'p99': sketch_quantile(sketch, 0.99),
+    } for name, sketch in sketches.items() if sketch['count']]
+    table = pd.DataFrame(rows, columns=[key, 'response_time_min', 'p50', 'p90', 'p99'])
+    return table.sort_values('response_time_min').reset_index(drop=True)
+
+
+def get_response_time_analysis(selected_user, response_df, pair_sketches=None):
+    if pair_sketches is None:
+        pair_sketches = response_sketches(response_df)
+
+    # Group-level analysis: every responder's sketch is the merge of their pair sketches
+    by_responder = {}
+    for (responder, sender), sketch in pair_sketches.items():
+        by_responder[responder] = (sketch_merge(by_responder[responder], sketch)
+                                   if responder in by_responder else sketch)
+    group_avg = _sketch_table(by_responder, 'responder')
 
     # Individual-level analysis
     if selected_user != 'Overall':
-        individual_df = response_df[response_df['responder'] == selected_user]
-        individual_avg = individual_df.groupby('sender')['response_time_min'].mean().sort_values().reset_index()
+        individual_avg = _sketch_table({sender: sketch for (responder, sender), sketch in pair_sketches.items()
+                                        if responder == selected_user}, 'sender')
         return group_avg, individual_avg
 
     return group_avg, None
 
 
+def _mention_aliases(users):
+    # Mentions name the full contact, its first name, or the phone digits of unsaved numbers.
+    # A first name shared by several members is ambiguous and skipped; exact names and digits win over first names
+    digits = [re.sub(r'\D', '', user) for user in users]
+    first_names = [user.split()[0].lower() if len(number) < 7 else None for user, number in zip(users, digits)]
+    aliases = {name: code for code, name in enumerate(first_names)
+               if name is not None and first_names.count(name) == 1}
+    for code, (user, number) in enumerate(zip(users, digits)):
+        if len(number) >= 7:
+            aliases[number] = code
+        aliases[re.sub(r'\s+', '', user).lower()] = code
+    return aliases
+
+
+def interaction_matrix(response_df, df, pair_sketches=None):
+    """Users x users reply counts, response-time percentiles and mention counts"""
+    users = sorted(u for u in df['user'].unique() if u != 'group_notification')
+    codes = pd.Series(np.arange(len(users)), index=users)
+    n = len(users)
+
+    # Rows are the member replying, columns the member being replied to
+    pair = (codes.reindex(response_df['responder']).to_numpy(dtype=np.int64) * n
+            + codes.reindex(response_df['sender']).to_numpy(dtype=np.int64))
+    replies = np.bincount(pair, minlength=n * n)
+
+    # Percentiles come from the per-pair sketches
+    if pair_sketches is None:
+        pair_sketches = response_sketches(response_df)
+    percentiles = np.full((3, n, n), np.nan)
+    for (responder, sender), sketch in pair_sketches.items():
+        if responder in codes.index and sender in codes.index:
+            percentiles[:, codes[responder], codes[sender]] = [
+                sketch_quantile(sketch, q) for q in (0.5, 0.9, 0.99)]
+
+    # Rows are the member writing the mention, columns the member mentioned
+    messages = df.loc[df['user'] != 'group_notification', ['user', 'mentions']]
+    found = messages['mentions'].str.split().explode().dropna().map(_mention_aliases(users))
+    found = found[found.notna()]
+    mentioner = codes.reindex(messages['user'].loc[found.index]).to_numpy(dtype=np.int64)
+    mentions = np.zeros((n, n), dtype=np.int64)
+    np.add.at(mentions, (mentioner, found.to_numpy(dtype=np.int64)), 1)
+
+    def square(values, rows='responder', columns='sender'):
+        return pd.DataFrame(values.reshape(n, n), index=pd.Index(users, name=rows),
+                            columns=pd.Index(users, name=columns))
+
+    return {
+        'reply_matrix': square(replies),
+        'p50_matrix': square(percentiles[0]),
+        'p90_matrix': square(percentiles[1]),
+        'p99_matrix': square(percentiles[2]),
+        'mention_matrix': square(mentions, 'mentioner', 'mentioned'),
+    }
+
+
 ## sentiment analyize
 
 
 def preprocess_for_sentiment(df):
-    """Clean messages for sentiment analysis"""
+    """Messages worth scoring, with links and mentions already removed by normalize_messages; only the columns
+    sentiment results need are kept"""
     filtered_df = df[
         (df['user'] != 'group_notification') &
-        (~df['message'].str.contains('<Media omitted>', na=False))
-    ].copy()
-
-    filtered_df['clean_msg'] = filtered_df['message'].apply(
-        lambda x: re.sub(r'http\S+|@\w+', '', str(x)).strip()
-    )
-    return filtered_df[filtered_df['clean_msg'] != '']
+        df['media_type'].isna() &
+        (df['clean_msg'] != '')
+    ]
+    return filtered_df[['dates', 'user', 'message', 'clean_msg']]
 
 def get_sentiment_scores(df):
     """Calculate sentiment scores for messages"""
@@ -267,14 +691,87 @@ def get_extreme_messages(df, user_filter=None):
     )
 
 
+## approximate analysis
+
+
+# Chats above this size default to sampled estimates in the dashboard
+APPROX_MIN_MESSAGES = 1_000_000
+APPROX_SAMPLE_SIZE = 50_000
+
+
+def stratified_sample(df, sample_size, random_state=42):
+    """Proportional random sample of about sample_size messages, stratified by user and month"""
+    strata = [df['user'], df['dates'].dt.to_period('M')]
+    stratum = df.groupby(strata, sort=False, observed=True).ngroup().to_numpy()
+    stratum_size = np.bincount(stratum)
+
+    # At least two draws per stratum so every stratum has a variance estimate
+    frac = min(1.0, sample_size / max(len(df), 1))
+    stratum_take = np.minimum(stratum_size, np.maximum(2, np.round(stratum_size * frac))).astype(np.int64)
+
+    # Rank messages within their stratum in random order and keep the first stratum_take of each
+    rng = np.random.default_rng(random_state)
+    order = np.lexsort((rng.random(len(df)), stratum))
+    starts = np.concatenate(([0], np.cumsum(stratum_size)[:-1]))
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[order] = np.arange(len(df)) - starts[stratum[order]]
+
+    keep = rank < stratum_take[stratum]
+    sample = df[keep].copy()
+    sample['stratum'] = stratum[keep]
+    sample['stratum_size'] = stratum_size[stratum[keep]]
+    return sample
+
+
+def stratified_mean(sample, column, z=1.96):
+    """Stratified estimate of a column mean with its confidence interval"""
+    strata = sample.groupby('stratum')
+    weight = strata['stratum_size'].first()
+    weight = weight / weight.sum()
+    n = strata[column].size()
+    variance = strata[column].var().fillna(0)
 
+    estimate = (weight * strata[column].mean()).sum()
+    # Finite population correction, since small strata are often sampled whole
+    error = z * np.sqrt((weight ** 2 * (1 - n / strata['stratum_size'].first()) * variance / n).sum())
+    return estimate, estimate - error, estimate + error
 
 
+def approximate_sentiment(sentiment_df, sample_size=APPROX_SAMPLE_SIZE):
+    """Sentiment scores for a stratified sample, plus the estimated average and label shares"""
+    sample = get_sentiment_scores(stratified_sample(sentiment_df, sample_size))
 
+    avg_estimate = stratified_mean(sample, 'sentiment')
 
+    label_rows = []
+    for label in ['Negative', 'Neutral', 'Positive']:
+        sample['is_label'] = (sample['sentiment_label'] == label).astype(float)
+        share, low, high = stratified_mean(sample, 'is_label')
+        label_rows.append({'label': label, 'percentage': share * 100,
+                           'ci_low': max(low, 0) * 100, 'ci_high': min(high, 1) * 100})
+    sample = sample.drop(columns='is_label')
 
+    return sample, avg_estimate, pd.DataFrame(label_rows)
 
 
+def approximate_response_times(df, gap=None, sample_size=APPROX_SAMPLE_SIZE):
+    """Response pairs for a stratified sample of sender messages"""
+    filtered_df, threshold = _response_candidates(df, gap)
+    if filtered_df.empty:
+        return _response_pairs(filtered_df, threshold)
 
+    sample = stratified_sample(filtered_df, sample_size)
+    return _response_pairs(filtered_df, threshold, np.sort(sample.index.to_numpy()))
 
 
+def response_time_intervals(response_df, z=1.96):
+    """Mean response time per responder with a normal-approximation confidence interval"""
+    stats = response_df.groupby('responder')['response_time_min'].agg(['mean', 'std', 'size'])
+    error = z * stats['std'].fillna(0) / np.sqrt(stats['size'])
+    return pd.DataFrame({
+        'responder': stats.index,
+        'response_time_min': stats['mean'].values,
+        'ci_low': (stats['mean'] - error).clip(lower=0).values,
+        'ci_high': (stats['mean'] + error).values,
+        'samples': stats['size'].values,
+    }).sort_values('response_time_min').reset_index(drop=True)
@@ -0,0 +1,174 @@
+"""Load test: N concurrent dashboard sessions, each uploading a synthetic export and running the analysis.
+
+    python loadtest.py --sessions 8 --messages 50000
+"""
+import argparse
+import datetime
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+WORDS = ("hello kya haal hai bhai ok yes no lol party tonight movie kal milte hain great awesome "
+         "bad sad thanks sorry www.example.com https://example.com/page 😂 ❤️ 👍 🙏").split()
+
+
+def synthetic_export(messages, users=5, gap_minutes=30, seed=0):
+    """An Android-style export with notifications, media placeholders, mentions and multi-line messages"""
+    rng = random.Random(seed)
+    names = [f'User {i}' for i in range(users)]
+    moment = datetime.datetime(2020, 1, 1, 9, 0)
+    lines = []
+    for _ in range(messages):
+        moment += datetime.timedelta(minutes=rng.expovariate(1 / gap_minutes))
+        hour = moment.hour % 12 or 12
+        stamp = f"{moment.day:02d}/{moment.month:02d}/{moment.year % 100:02d}, {hour}:{moment.minute:02d} {'AM' if moment.hour < 12 else 'PM'}"
+        user = rng.choice(names)
+
+        roll = rng.random()
+        if roll < 0.02:
+            lines.append(f"{stamp} - {user} joined using this group's invite link")
+            continue
+        if roll < 0.07:
+            text = '<Media omitted>'
+        elif roll < 0.10:
+            text = f"@{rng.choice(names)} " + ' '.join(rng.choices(WORDS, k=rng.randint(1, 8)))
+        else:
+            text = ' '.join(rng.choices(WORDS, k=rng.randint(1, 12)))
+        lines.append(f"{stamp} - {user}: {text}")
+        if rng.random() < 0.03:
+            lines.append(' '.join(rng.choices(WORDS, k=rng.randint(1, 6))))
+    return '\n'.join(lines).encode('utf-8')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def run_session(session, raw, approximate, timeout):
+    """Upload, then analyze; the wall time of each script run is recorded"""
+    timings, errors = {}, []
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    started = time.perf_counter()
+    app.run()
+    timings['startup'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    app.sidebar.file_uploader[0].set_value((f'session_{session}.txt', raw, 'text/plain'))
+    app.run()
+    timings['upload'] = time.perf_counter() - started
+
+    if approximate:
+        app.sidebar.toggle[0].set_value(True)
+        app.run()
+
+    started = time.perf_counter()
+    app.sidebar.button[0].click()
+    app.run()
+    timings['analyze'] = time.perf_counter() - started
+
+    errors.extend(e.message for e in app.exception)
+    errors.extend(e.value for e in app.error)
+    timings['total'] = sum(timings.values())
+    return timings, errors
+
+
+class CpuSampler(threading.Thread):
+    """Process CPU use over short intervals, as a fraction of all cores"""
+
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        last_cpu, last_wall = self._cpu(), time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            cpu, wall = self._cpu(), time.perf_counter()
+            self.samples.append((cpu - last_cpu) / ((wall - last_wall) * os.cpu_count()))
+            last_cpu, last_wall = cpu, wall
+
+    @staticmethod
+    def _cpu():
+        times = os.times()
+        return times.user + times.system
+
+
+def report(results, wall, cpu_seconds, sampler):
+    stages = ['startup', 'upload', 'analyze', 'total']
+    print(f"\n{'stage':<10}{'p50 s':>10}{'p90 s':>10}{'p99 s':>10}{'max s':>10}")
+    for stage in stages:
+        values = np.array([timings[stage] for timings, _ in results if stage in timings])
+        if len(values):
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            print(f"{stage:<10}{p50:>10.2f}{p90:>10.2f}{p99:>10.2f}{values.max():>10.2f}")
+
+    cores = os.cpu_count()
+    busy = cpu_seconds / wall
+    print(f"\nwall time      {wall:.1f} s")
+    print(f"peak RSS       {peak_rss_mb():.0f} MB")
+    print(f"CPU            {cpu_seconds:.1f} s, {busy:.2f} of {cores} cores busy on average ({busy / cores:.0%})")
+    if sampler.samples:
+        saturated = np.mean(np.array(sampler.samples) >= 0.9)
+        print(f"CPU peak       {max(sampler.samples):.0%} of all cores, saturated {saturated:.0%} of the time")
+
+    failed = [(session, errors) for session, (_, errors) in enumerate(results) if errors]
+    print(f"sessions       {len(results) - len(failed)} ok, {len(failed)} failed")
+    for session, errors in failed:
+        print(f"  session {session}: {errors[0][:200]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=4, help='concurrent sessions')
+    parser.add_argument('--messages', type=int, default=20000, help='messages per synthetic export')
+    parser.add_argument('--users', type=int, default=5, help='members per synthetic chat')
+    parser.add_argument('--gap-minutes', type=float, default=30, help='mean minutes between messages')
+    parser.add_argument('--same-file', action='store_true', help='every session uploads the same export (exercises the caches)')
+    parser.add_argument('--approximate', action='store_true', help='turn on approximate mode before analysing')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds allowed per script run')
+    args = parser.parse_args()
+
+    # Chart warnings from every session would bury the report
+    warnings.simplefilter('ignore')
+    logging.getLogger('matplotlib').setLevel(logging.ERROR)
+
+    exports = [synthetic_export(args.messages, args.users, args.gap_minutes, seed=0 if args.same_file else session)
+               for session in range(args.sessions)]
+    print(f"{args.sessions} sessions, {args.messages:,} messages each "
+          f"({np.mean([len(raw) for raw in exports]) / 2 ** 20:.1f} MB per export)")
+
+    sampler = CpuSampler()
+    sampler.start()
+    cpu_before, started = CpuSampler._cpu(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [pool.submit(run_session, session, raw, args.approximate, args.timeout)
+                   for session, raw in enumerate(exports)]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as error:
+                results.append(({}, [f'{type(error).__name__}: {error}']))
+    wall, cpu_seconds = time.perf_counter() - started, CpuSampler._cpu() - cpu_before
+    sampler.stopped.set()
+
+    report(results, wall, cpu_seconds, sampler)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,62 +1,297 @@
-from datetime import datetime
+import io
+import mmap
+from array import array
 import re
+import zipfile
 import pandas as pd
 import numpy as np
-from datetime import datetime
-from dateutil.parser import parse
 
 
+# Building blocks of a message header; the date, time and AM/PM marker are captured in that order
+NUMERIC_DATE = r'(\d{1,4}[/.-]\d{1,2}[/.-]\d{2,4})'
+NAMED_DATE = r'(\d{1,2}\.?\s(?:de\s)?[^\W\d_]{3,}\.?,?\s(?:de\s)?\d{2,4})'
+TIME = r'(\d{1,2}[:.]\d{2}(?:[:.]\d{2})?)'
+AM_PM = r'(?:[\s\u202f\u00a0]*([AaPp]\.?\s?[Mm]\.?))?'
+HEADER_PARTS = {
+    'prefix': r'^[ \t\ufeff\u200e\u200f]*',
+    'numeric_date': NUMERIC_DATE, 'named_date': NAMED_DATE, 'time': TIME, 'am_pm': AM_PM,
+}
+# The same blocks over UTF-8 bytes, for scanning memory-mapped files; non-ASCII characters are byte sequences.
+# Every number is captured on its own, so headers go straight into integer arrays
+HEADER_BYTES_PARTS = {
+    'prefix': r'^(?:[ \t]|\xef\xbb\xbf|\xe2\x80[\x8e\x8f])*',
+    'numeric_date': r'(\d{1,4})[/.-](\d{1,2})[/.-](\d{2,4})',
+    'named_date': r'(\d{1,2})\.?\s(?:de\s)?((?:[^\W\d_]|[\x80-\xff]){3,})\.?,?\s(?:de\s)?(\d{2,4})',
+    'time': r'(\d{1,2})[:.](\d{2})(?:[:.](\d{2}))?',
+    'am_pm': r'(?:(?:\s|\xe2\x80\xaf|\xc2\xa0)*([AaPp]\.?\s?[Mm]\.?))?',
+}
+# Follows a bytes header: the sender, up to the first colon; system notifications have none
+SENDER_BYTES = r'(?:([^:\n]+?):(?:\r\n|\s))?'
 
-def preprocess(data):
-    cleaned_data = []
+# Lines starting with a header open a new message; any other line continues the previous one
+CHAT_FORMATS = []
 
-    for line in data:
-        # Remove AM/PM variations with optional unicode/regular spaces before them (case-insensitive)
-        line = re.sub(r'[\u202f\u00a0 ]?\bAM\b', '', line, flags=re.IGNORECASE)
-        line = re.sub(r'[\u202f\u00a0 ]?\bPM\b', '', line, flags=re.IGNORECASE)
+# How many lines are inspected to pick the export format, and how many bytes hold them in a mapped file
+SNIFF_LINES = 300
+SNIFF_BYTES = 64 * 1024
 
-        # Remove leading/trailing junk characters
-        line = line.strip(" '\n,")
+# Media kinds by file extension, for "export with media" archives
+MEDIA_TYPES = {
+    'jpg': 'image', 'jpeg': 'image', 'png': 'image', 'heic': 'image',
+    'webp': 'sticker', 'gif': 'gif',
+    'mp4': 'video', '3gp': 'video', 'mov': 'video', 'mkv': 'video',
+    'opus': 'audio', 'ogg': 'audio', 'm4a': 'audio', 'mp3': 'audio', 'aac': 'audio', 'amr': 'audio',
+    'pdf': 'document', 'doc': 'document', 'docx': 'document', 'xls': 'document', 'xlsx': 'document',
+    'ppt': 'document', 'pptx': 'document', 'txt': 'document', 'zip': 'document',
+    'vcf': 'contact',
+}
 
-        # Normalize weird spacing before hyphen (e.g., double space before dash)
-        line = re.sub(r'\s{2,}-', ' -', line)     # e.g. "  -" → " -"
-        line = re.sub(r'\s+-', ' -', line)        # e.g. "   -" or " -" → " -"
+# "<attached: 00000012-PHOTO-2023-01-13.jpg>" on iOS, "IMG-20230113-WA0001.jpg (file attached)" on Android
+ATTACHED_MEDIA = r'^\u200e?(?:<attached: (?P<ios>[^>\n]+)>|(?P<android>[^\s/]+\.\w+) \(file attached\))'
+# Exports without media keep only a placeholder
+OMITTED_MEDIA = r'^\u200e?(?P<placeholder><Media omitted>|(?P<kind>image|video|audio|sticker|GIF|document|Contact card) omitted)$'
 
-        cleaned_data.append(line)
+MONTH_NAMES = {}
+for names in [
+    # English, French, German, Spanish, Portuguese, Italian; full names then abbreviations
+    'january february march april may june july august september october november december',
+    'jan feb mar apr may jun jul aug sep oct nov dec',
+    'janvier février mars avril mai juin juillet août septembre octobre novembre décembre',
+    'janv févr mars avr mai juin juil août sept oct nov déc',
+    'januar februar märz april mai juni juli august september oktober november dezember',
+    'jan feb mär apr mai jun jul aug sep okt nov dez',
+    'enero febrero marzo abril mayo junio julio agosto septiembre octubre noviembre diciembre',
+    'ene feb mar abr may jun jul ago sept oct nov dic',
+    'janeiro fevereiro março abril maio junho julho agosto setembro outubro novembro dezembro',
+    'jan fev mar abr mai jun jul ago set out nov dez',
+    'gennaio febbraio marzo aprile maggio giugno luglio agosto settembre ottobre novembre dicembre',
+    'gen feb mar apr mag giu lug ago set ott nov dic',
+]:
+    MONTH_NAMES.update({name: number for number, name in enumerate(names.split(), start=1)})
+MONTH_NAMES.update({'sept': 9, 'mrz': 3})
 
-    date_time_list = []
-    message_list = []
 
+def register_format(name, header, month_names=False):
+    """Add an export layout; header is a template over HEADER_PARTS capturing date, time and an optional AM/PM marker"""
+    CHAT_FORMATS.append({
+        'name': name,
+        'header': re.compile(header.format(**HEADER_PARTS), re.MULTILINE),
+        'header_bytes': re.compile((header.format(**HEADER_BYTES_PARTS) + SENDER_BYTES).encode('ascii'), re.MULTILINE),
+        'month_names': month_names,
+    })
 
-    pattern = r'^(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}),\s*(\d{1,2}:\d{2})\s*-\s*(.+)'
 
-    for line in cleaned_data:
-        match = re.match(pattern, line)
-        if match:
-            date, time, message = match.groups()
-            date_time_list.append(f"{date}, {time}")
-            message_list.append(message)
+# Android: "31/12/23, 9:05 PM - user: message"
+register_format('android', r'{prefix}{numeric_date},?\s{time}{am_pm}\s*-\s')
+# iOS: "[31/12/23, 21:05:09] user: message"
+register_format('ios', r'{prefix}\[{numeric_date},?\s{time}{am_pm}\]\s')
+# Localized month names: "31 déc. 2023, 21:05 - user: message"
+register_format('android_month_names', r'{prefix}{named_date},?\s{time}{am_pm}\s*-\s', month_names=True)
+register_format('ios_month_names', r'{prefix}\[{named_date},?\s{time}{am_pm}\]\s', month_names=True)
 
-    df = pd.DataFrame({'user_message': message_list, 'dates': date_time_list})
-    # df['dates'] = pd.to_datetime(df['dates'], errors='coerce')
-    df['dates'] = df['dates'].apply(parse)
 
-    users = []
+def sniff_format(lines):
+    """The registered format whose header matches most of the given lines, or None"""
+    best, best_hits = None, 0
+    for chat_format in CHAT_FORMATS:
+        hits = sum(1 for line in lines if chat_format['header'].match(line))
+        if hits > best_hits:
+            best, best_hits = chat_format, hits
+    return best
+
+
+def _date_order(first, second, third):
+    # Day, month and year from numeric date parts in whatever order the export locale uses
+    if (first >= 1000).any():
+        return third, second, first
+    if (first > 12).any():
+        return first, second, third
+    if (second > 12).any():
+        return second, first, third
+
+    # Ambiguous in every line: pick the reading under which the chat runs forwards in time
+    def backwards(day, month):
+        stamps = pd.to_datetime(pd.DataFrame({'year': third, 'month': month, 'day': day}), errors='coerce')
+        return (stamps.diff().dt.days < 0).sum()
+
+    if backwards(second, first) < backwards(first, second):
+        return second, first, third
+    return first, second, third
+
+
+def _date_parts(dates, chat_format):
+    # Day, month and year columns of the date strings of a text export
+    if chat_format['month_names']:
+        parts = dates.str.extract(r'(\d{1,2})\.?\s(?:de\s)?([^\W\d_]+)\.?,?\s(?:de\s)?(\d{2,4})')
+        month = parts[1].str.lower().map(MONTH_NAMES)
+        return pd.to_numeric(parts[0]), month, pd.to_numeric(parts[2])
+
+    parts = dates.str.split(r'[/.-]', expand=True, regex=True)
+    return _date_order(*(pd.to_numeric(parts[i]) for i in range(3)))
+
+
+def _timestamps(day, month, year, hour, minute, second, clock):
+    # clock is 0 on 24-hour exports, 1 for AM and 2 for PM; 12 AM is midnight, PM adds twelve hours
+    year = year.where(year >= 100, year + 2000)
+    hour = hour.where(clock == 0, hour % 12 + np.where(clock == 2, 12, 0))
+    return pd.to_datetime(pd.DataFrame({
+        'year': year, 'month': month, 'day': day,
+        'hour': hour, 'minute': minute, 'second': second,
+    }), errors='coerce')
+
+
+def _build_dates(headers, chat_format):
+    day, month, year = _date_parts(headers['date'], chat_format)
+
+    clock = headers['time'].str.split(r'[:.]', expand=True, regex=True)
+    hour = pd.to_numeric(clock[0])
+    minute = pd.to_numeric(clock[1])
+    second = pd.to_numeric(clock[2]).fillna(0) if 2 in clock.columns else 0
+
+    marker = headers['am_pm'].fillna('').str[:1].str.lower()
+    return _timestamps(day, month, year, hour, minute, second,
+                       np.where(marker == '', 0, np.where(marker == 'p', 2, 1)))
+
+
+def _parse_text(text, chat_format):
+    # Header matches mark message boundaries; each message runs until the next header
+    starts, ends, headers = [], [], []
+    for match in chat_format['header'].finditer(text):
+        starts.append(match.start())
+        ends.append(match.end())
+        headers.append(match.groups())
+
+    bounds = starts[1:] + [len(text)]
+    messages = [text[end:bound].rstrip('\n') for end, bound in zip(ends, bounds)]
+    return pd.DataFrame(headers, columns=['date', 'time', 'am_pm']), messages
+
+
+def _parse_mapped(buffer, chat_format):
+    # Same as _parse_text over raw bytes; the header match also splits off the sender, so only senders
+    # and message texts are ever decoded, and every sender name is decoded once
+    numbers = [array('H') for _ in range(6)]
+    clock = array('B')
+    starts, ends, users, senders = array('q'), array('q'), [], {}
+    month_names = chat_format['month_names']
+    for match in chat_format['header_bytes'].finditer(buffer):
+        first, second, third, hour, minute, seconds, marker, sender = match.groups()
+        starts.append(match.start())
+        ends.append(match.end())
+        numbers[0].append(int(first))
+        numbers[1].append(MONTH_NAMES.get(second.decode('utf-8', errors='replace').lower(), 0)
+                          if month_names else int(second))
+        numbers[2].append(int(third))
+        numbers[3].append(int(hour))
+        numbers[4].append(int(minute))
+        numbers[5].append(int(seconds) if seconds else 0)
+        clock.append(0 if marker is None else 2 if marker[:1] in b'Pp' else 1)
+        if sender not in senders:
+            senders[sender] = 'group_notification' if sender is None else sender.decode('utf-8', errors='replace')
+        users.append(senders[sender])
+
+    crlf = b'\r\n' in buffer[:SNIFF_BYTES]
+    bounds = starts[1:] + array('q', [len(buffer)])
     messages = []
+    for end, bound in zip(ends, bounds):
+        message = buffer[end:bound].decode('utf-8', errors='replace')
+        messages.append((message.replace('\r\n', '\n') if crlf else message).rstrip('\n'))
 
-    for msg in df['user_message']:
-        # Try splitting only at the first colon that separates user from message
-        split_msg = re.split(r'^([^:]+?):\s', msg)
-        if len(split_msg) == 3:
-            users.append(split_msg[1])
-            messages.append(split_msg[2])
-        else:
-            users.append('group_notification')
-            messages.append(msg)
+    first, second, third, hour, minute, seconds = (pd.Series(np.frombuffer(column, dtype=np.uint16).astype(np.int64))
+                                                    for column in numbers)
+    day, month, year = (first, second, third) if month_names else _date_order(first, second, third)
+    dates = _timestamps(day, month, year, hour, minute, seconds, np.frombuffer(clock, dtype=np.uint8))
+    return dates, users, messages
 
-    df['user'] = users
-    df['message'] = messages
-    df.drop(columns=['user_message'], inplace=True)
+
+def _media_columns(df, media_manifest=None):
+    # Attached file name and media kind of every media message; NaN for everything else
+    attached = df['message'].str.extract(ATTACHED_MEDIA)
+    df['media_file'] = attached['ios'].where(attached['ios'].notna(), attached['android'])
+    extension = df['media_file'].astype('string').str.extract(r'\.(\w+)$')[0].str.lower()
+    df['media_type'] = extension.map(MEDIA_TYPES).fillna('other').where(df['media_file'].notna()).astype(object)
+
+    omitted = df['message'].str.extract(OMITTED_MEDIA)
+    is_omitted = omitted['placeholder'].notna()
+    df.loc[is_omitted, 'media_type'] = omitted.loc[is_omitted, 'kind'].str.lower().fillna('media')
+
+    if media_manifest is not None:
+        manifest = media_manifest.set_index('file')
+        df['media_size'] = df['media_file'].map(manifest['size_bytes'])
+        df['media_type'] = df['media_file'].map(manifest['media_type']).fillna(df['media_type'])
+    return df
+
+
+def read_media_manifest(archive):
+    """Type and size of every attachment in an export archive, read from the ZIP directory only"""
+    files = [info for info in archive.infolist() if not info.is_dir()]
+    manifest = pd.DataFrame({
+        'file': [info.filename.rsplit('/', 1)[-1] for info in files],
+        'size_bytes': [info.file_size for info in files],
+    })
+    extension = manifest['file'].str.extract(r'\.(\w+)$')[0].str.lower()
+    manifest['media_type'] = extension.map(MEDIA_TYPES).fillna('other')
+    return manifest
+
+
+def _chat_member(archive):
+    # The chat text is "_chat.txt" on iOS and "WhatsApp Chat with <name>.txt" on Android
+    texts = [info for info in archive.infolist() if info.filename.lower().endswith('.txt')]
+    if not texts:
+        raise ValueError("The archive does not contain a WhatsApp chat text file")
+    named = [info for info in texts
+             if info.filename.rsplit('/', 1)[-1] == '_chat.txt' or 'whatsapp chat' in info.filename.lower()]
+    return max(named or texts, key=lambda info: info.file_size)
+
+
+def preprocess_zip(file):
+    """Parse an "export with media" ZIP: only the chat text is decompressed, streamed into the parser"""
+    with zipfile.ZipFile(file) as archive:
+        member = _chat_member(archive)
+        manifest = read_media_manifest(archive)
+        manifest = manifest[manifest['file'] != member.filename.rsplit('/', 1)[-1]]
+        with archive.open(member) as raw:
+            return preprocess(io.TextIOWrapper(raw, encoding='utf-8-sig'), manifest)
+
+
+def _empty_frame():
+    return pd.DataFrame(columns=['dates', 'user', 'message', 'year', 'month', 'month_num',
+                                 'day', 'days_name', 'hour', 'minute', 'period', 'media_file', 'media_type']).astype({'dates': 'datetime64[ns]'})
+
+
+def preprocess_file(path, media_manifest=None):
+    """Parse an export on local disk through a memory map, without decoding the whole file at once"""
+    with open(path, 'rb') as file:
+        if not file.seek(0, io.SEEK_END):
+            return _empty_frame()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            head = buffer[:SNIFF_BYTES].decode('utf-8', errors='ignore').splitlines()
+            chat_format = sniff_format(head[:SNIFF_LINES])
+            if chat_format is None:
+                return _empty_frame()
+            dates, users, messages = _parse_mapped(buffer, chat_format)
+    return _build_frame(dates, users, messages, media_manifest)
+
+
+def preprocess(data, media_manifest=None):
+    lines = [line.rstrip('\r\n') for line in data]
+    chat_format = sniff_format(lines[:SNIFF_LINES])
+    if chat_format is None:
+        return _empty_frame()
+
+    headers, messages = _parse_text('\n'.join(lines), chat_format)
+    # Split only at the first colon that separates user from message
+    messages = pd.Series(messages, dtype=object)
+    split_msg = messages.str.extract(r'^([^:\n]+?):\s(.*)$', flags=re.DOTALL)
+    return _build_frame(_build_dates(headers, chat_format), split_msg[0].fillna('group_notification'),
+                        split_msg[1].fillna(messages), media_manifest)
+
+
+def _build_frame(dates, users, messages, media_manifest=None):
+    df = pd.DataFrame({'dates': dates, 'user': users, 'message': messages})
+    df = df[df['dates'].notna()]
+    # Keep the frame ordered by time so date ranges can be sliced with searchsorted
+    df = df.sort_values('dates', kind='stable').reset_index(drop=True)
+    df = _media_columns(df, media_manifest)
 
     df['year'] = df['dates'].dt.year
     df['month'] = df['dates'].dt.month_name()
@@ -68,7 +303,7 @@ def preprocess(data):
 
     period = []
     for hour in df[['days_name', 'hour']]['hour']:
-        if hour == 12:
+        if hour == 23:
             period.append(str(hour) + "-" + str('00'))
         elif hour == 0:
             period.append(str('00') + "-" + str(hour + 1))
@@ -77,4 +312,3 @@ def preprocess(data):
     df['period'] = period
 
     return df
-
@@ -0,0 +1,181 @@
+import io
+import json
+import zipfile
+import numpy as np
+import pandas as pd
+import helper
+
+
+# Analysis bundle: a zip holding the parsed chat plus every result the dashboard renders,
+# so a shared analysis opens without parsing or analysing the chat again
+BUNDLE_VERSION = 5
+BUNDLE_EXTENSION = 'wca'
+
+# Results that are the same whichever member is selected
+SHARED_RESULTS = ['threshold', 'top_users', 'top_user_share', 'group_avg', 'response_intervals',
+                  'reply_matrix', 'p50_matrix', 'p90_matrix', 'p99_matrix', 'mention_matrix',
+                  'sentiment_df', 'sentiment_estimate', 'label_shares', 'timeline_freq', 'sentiment_trend']
+
+
+def chat_results(df, time_index, start, end, approximate=False, exact_results=None):
+    """Results shared by every member: sessions, top users, response times and sentiment"""
+    # Sessions are segmented once and their gap threshold is shared with the response times
+    session_df, threshold = helper.assign_sessions(df.loc[df['user'] != 'group_notification', ['dates', 'user']])
+    session_stats = helper.session_stats(session_df)
+    top_users, top_user_share = helper.most_busy_person(df, helper.range_user_counts(time_index, start, end))
+
+    response_intervals = None
+    if exact_results is not None:
+        response_df = exact_results[0]
+    elif approximate:
+        response_df = helper.approximate_response_times(df, threshold)
+        response_intervals = helper.response_time_intervals(response_df)
+    else:
+        response_df = helper.get_response_times_df(df, threshold)
+    pair_sketches = helper.response_sketches(response_df)
+    group_avg, _ = helper.get_response_time_analysis('Overall', response_df, pair_sketches)
+
+    sentiment_df = helper.preprocess_for_sentiment(df)
+    sentiment_estimate, label_shares = None, None
+    if sentiment_df.empty:
+        pass
+    elif exact_results is not None:
+        sentiment_df = exact_results[1]
+    elif approximate:
+        sentiment_df, sentiment_estimate, label_shares = helper.approximate_sentiment(sentiment_df)
+    else:
+        sentiment_df = helper.get_sentiment_scores(sentiment_df)
+
+    # One granularity for the whole range, so activity and sentiment trends share their periods
+    timeline_freq = helper.timeline_frequency(start, end)
+    sentiment_trend = None if sentiment_df.empty else helper.sentiment_timeline(sentiment_df, timeline_freq)
+
+    return {
+        'session_stats': session_stats,
+        'starters': helper.conversation_starters(session_stats),
+        # Which sessions each member took part in, in session order
+        'member_sessions': session_df[['user', 'session_id']].drop_duplicates(),
+        'threshold': threshold,
+        'top_users': top_users,
+        'top_user_share': top_user_share,
+        'response_df': response_df,
+        'group_avg': group_avg,
+        'response_intervals': response_intervals,
+        **helper.interaction_matrix(response_df, df, pair_sketches),
+        'sentiment_df': sentiment_df,
+        'sentiment_estimate': sentiment_estimate,
+        'label_shares': label_shares,
+        'timeline_freq': timeline_freq,
+        'sentiment_trend': sentiment_trend,
+    }
+
+
+def user_results(selected_user, df, time_index, token_index, shared, start, end):
+    """Results that depend on the selected member"""
+    stats = shared['session_stats']
+    if selected_user != 'Overall':
+        member_sessions = shared['member_sessions']
+        stats = stats.loc[member_sessions.loc[member_sessions['user'] == selected_user, 'session_id']]
+
+    return {
+        'summary': list(helper.fetch_start(selected_user, df, time_index, start, end)),
+        'media': helper.media_stats(selected_user, df),
+        'timeline': helper.activity_timeline(selected_user, df, shared['timeline_freq']),
+        'heatmap': helper.activity_heatmap(selected_user, df),
+        'busy_days': helper.busyday_graph(selected_user, df),
+        'busy_months': helper.monthbusy_graph(selected_user, df),
+        'word_frequencies': helper.word_frequencies(selected_user, token_index, start, end),
+        'common_words': helper.most_common_words(selected_user, token_index, start, end),
+        'emojis': helper.emoji_analysis(selected_user, df),
+        'session_stats': stats,
+        'starters': shared['starters'],
+    }
+
+
+## bundle files
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    raise TypeError(f"Cannot store {type(value).__name__} in an analysis bundle")
+
+
+def _write_frame(zf, path, frame):
+    # Parquet needs string column names; the originals are restored on read
+    columns = list(frame.columns)
+    frame = frame.set_axis([str(c) for c in columns], axis=1)
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer)
+    zf.writestr(path, buffer.getvalue())
+    return columns
+
+
+def _pack(zf, path, value):
+    if isinstance(value, pd.DataFrame):
+        return {'kind': 'frame', 'path': path + '.parquet',
+                'columns': _write_frame(zf, path + '.parquet', value)}
+    if isinstance(value, pd.Series):
+        name = value.name if value.name is not None else 'value'
+        _write_frame(zf, path + '.parquet', value.to_frame(name=name))
+        return {'kind': 'series', 'path': path + '.parquet', 'name': value.name}
+    return {'kind': 'value', 'value': value}
+
+
+def _unpack(zf, entry):
+    if entry['kind'] == 'value':
+        return entry['value']
+
+    frame = pd.read_parquet(io.BytesIO(zf.read(entry['path'])))
+    if entry['kind'] == 'series':
+        return frame.iloc[:, 0].rename(entry['name'])
+    frame.columns = entry['columns']
+    return frame
+
+
+def save_bundle(df, time_index, token_index):
+    """Analyse the whole chat for every member and pack it all into bundle bytes"""
+    start, end = df['dates'].iloc[0].date(), df['dates'].iloc[-1].date()
+    users = ['Overall'] + sorted([u for u in df['user'].unique() if u != 'group_notification'])
+    shared = chat_results(df, time_index, start, end)
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        # The normalized chat itself, so other date windows can be analysed without parsing the export again
+        _write_frame(zf, 'chat.parquet', df)
+        manifest = {
+            'version': BUNDLE_VERSION,
+            'users': users,
+            'shared': {key: _pack(zf, f'shared/{key}', shared[key]) for key in SHARED_RESULTS},
+            'per_user': [],
+        }
+        for i, user in enumerate(users):
+            results = user_results(user, df, time_index, token_index, shared, start, end)
+            manifest['per_user'].append({key: _pack(zf, f'users/{i}/{key}', value)
+                                         for key, value in results.items()})
+        zf.writestr('manifest.json', json.dumps(manifest, default=_json_default))
+
+    return buffer.getvalue()
+
+
+def open_bundle(raw):
+    """Open bundle bytes; results are only read when a member is displayed"""
+    zf = zipfile.ZipFile(io.BytesIO(raw))
+    manifest = json.loads(zf.read('manifest.json'))
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported analysis bundle version: {manifest.get('version')}")
+    return {'zip': zf, 'manifest': manifest}
+
+
+def bundle_results(bundle, selected_user):
+    """Everything the dashboard renders for one member, read straight from the bundle"""
+    zf, manifest = bundle['zip'], bundle['manifest']
+    entries = {**manifest['shared'], **manifest['per_user'][manifest['users'].index(selected_user)]}
+    return {key: _unpack(zf, entry) for key, entry in entries.items()}
+
+
+def bundle_chat(bundle):
+    """The normalized chat stored in the bundle"""
+    return pd.read_parquet(io.BytesIO(bundle['zip'].read('chat.parquet')))